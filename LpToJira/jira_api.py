@@ -5,7 +5,15 @@
 import os
 import json
 
-from jira import JIRA
+from functools import partial
+from types import SimpleNamespace
+
+from LpToJira.workers import run_ordered
+
+
+class jira_init_error(ValueError):
+    """Raised when the JIRA credentials can't be found nor entered"""
+
 
 class jira_api():
     def __init__(self,credstore="{}/.jira.token".format(os.path.expanduser('~'))):
@@ -25,7 +33,7 @@ class jira_api():
             print('')
             gather_token = input('Do you want to enter your JIRA token information now? (Y/n) ')
             if gather_token == 'n':
-                raise ValueError("JIRA API isn't initialized")
+                raise jira_init_error("JIRA API isn't initialized")
             self.server = input('Please enter your jira server address : ')
             self.login = input('Please enter your email login for JIRA : ')
             self.token = input('Please enter your JIRA API Token (see https://id.atlassian.com/manage-profile/security/api-tokens) : ')
@@ -39,4 +47,180 @@ class jira_api():
                     with open(self.credstore,'w+') as f:
                         json.dump(data,(f))
                 except (FileNotFoundError, json.JSONDecodeError):
-                    raise ValueError("JIRA API isn't initialized")
\ No newline at end of file
+                    raise jira_init_error("JIRA API isn't initialized")
+
+
+class lazy_api():
+    """
+    Stand-in for an API session, only calling connect() to open the real
+    session the first time one of its attributes is used
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._api = None
+
+    @property
+    def connected(self):
+        return self._api is not None
+
+    def __getattr__(self, name):
+        if self._api is None:
+            self._api = self._connect()
+        return getattr(self._api, name)
+
+
+class jira_issue_cache():
+    """
+    JIRA issues of a run by their key. Issues found by a search can be
+    added so they are not fetched again, the others are fetched once
+    """
+
+    def __init__(self, jira):
+        self.jira = jira
+        self.issues = {}
+
+    def add(self, issue):
+        self.issues[issue.key] = issue
+
+    def get(self, key):
+        issue = self.issues.get(key)
+        if issue is None:
+            issue = self.jira.issue(key)
+            self.issues[key] = issue
+        return issue
+
+
+class stored_issue():
+    """
+    Stand-in for a JIRA issue whose summary, status and labels are already
+    known, from lp_jira_db for instance. Comments and transitions only
+    need its key, the issue itself is fetched by update()
+    """
+
+    def __init__(self, jira, key, summary, status, labels):
+        self.jira = jira
+        self.key = key
+        self.fields = SimpleNamespace(
+            summary=summary,
+            status=SimpleNamespace(name=status),
+            labels=labels)
+
+    def __str__(self):
+        return self.key
+
+    def update(self, **fields):
+        self.jira.issue(self.key).update(**fields)
+
+
+def jira_connect():
+    """Return a JIRA session using the stored JIRA credentials"""
+    # Importing jira is slow, only do it when JIRA is actually needed
+    from jira import JIRA
+
+    api = jira_api()
+    return JIRA(api.server, basic_auth=(api.login, api.token))
+
+
+class issue_search():
+    """
+    Iterable going through every issue matching jql, fields restricts the
+    fields JIRA returns for each issue. Once gone through, complete tells
+    whether every issue was seen for sure: the last page said it was the
+    last one or as many issues as the total JIRA announced came back.
+    JIRA Cloud gives a token to fetch the next page with, the pages are
+    then fetched one after the other. Otherwise JIRA serves at most its
+    own maximum page size whatever batch asks for, the first page tells
+    how big pages are and how many issues match, the other pages are then
+    fetched jobs at a time
+    """
+
+    def __init__(self, jira, jql, fields=None, batch=1000, jobs=4):
+        self.jira = jira
+        self.jql = jql
+        self.fields = fields
+        self.batch = batch
+        self.jobs = jobs
+        self.complete = False
+        self.fetched = 0
+
+    def __iter__(self):
+        self.complete = False
+        self.fetched = 0
+        for issue in self.search():
+            self.fetched += 1
+            yield issue
+
+    def search(self):
+        issues = self.jira.search_issues(
+            self.jql, startAt=0, maxResults=self.batch, fields=self.fields)
+
+        if not issues:
+            self.complete = True
+            return
+
+        yield from issues
+
+        token = getattr(issues, 'nextPageToken', None)
+        if token:
+            yield from self.search_tokens(token)
+            return
+
+        total = getattr(issues, 'total', None)
+        if total is None:
+            yield from self.search_pages(len(issues))
+            return
+
+        # Without a token the total comes from the server, JIRA Cloud only
+        # gives len(issues) as total on its last page
+        page_size = len(issues)
+        for _, issues, error in run_ordered(
+                partial(search_page, self.jira, self.jql, self.fields,
+                        page_size),
+                range(page_size, total, page_size),
+                self.jobs):
+            if error:
+                raise error
+
+            yield from issues or []
+
+        # Issues can move between pages while they are fetched
+        self.complete = self.fetched >= total
+
+    def search_tokens(self, token):
+        """Follow the next page tokens of JIRA Cloud up to the last page"""
+        while token:
+            issues = self.jira.enhanced_search_issues(
+                self.jql, nextPageToken=token, maxResults=self.batch,
+                fields=self.fields)
+            yield from issues
+            token = getattr(issues, 'nextPageToken', None)
+        self.complete = True
+
+    def search_pages(self, start_index):
+        """Without a total, go through the pages one after the other"""
+        while True:
+            issues = self.jira.search_issues(
+                self.jql, startAt=start_index, maxResults=self.batch,
+                fields=self.fields)
+
+            if not issues:
+                self.complete = True
+                return
+
+            start_index += len(issues)
+            yield from issues
+
+
+def search_all_issues(jira, jql, fields=None, batch=1000, jobs=4):
+    """
+    Generator going through every issue matching jql, see issue_search for
+    the parameters
+    """
+    return iter(issue_search(jira, jql, fields, batch, jobs))
+
+
+def search_page(jira, jql, fields, page_size, start_index):
+    """Return the page of the jql search starting at start_index"""
+    return jira.search_issues(
+        jql, startAt=start_index, maxResults=page_size, fields=fields)
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+# Queue the changes lp-to-jira-report makes to JIRA issues and write them
+# from a few threads, retrying when JIRA is busy or failing
+
+
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class jira_action():
+    """
+    A change to make to a JIRA issue, run() does it. An action that isn't
+    idempotent is only run again when JIRA surely didn't do it
+    """
+
+    idempotent = True
+
+    def __init__(self, issue):
+        self.issue = issue
+
+    @property
+    def key(self):
+        return self.issue.key
+
+    def run(self, jira):
+        raise NotImplementedError
+
+
+class jira_comment(jira_action):
+    # Adding the comment again after a 5xx could post it twice
+    idempotent = False
+
+    def __init__(self, issue, body):
+        super().__init__(issue)
+        self.body = body
+
+    def run(self, jira):
+        jira.add_comment(self.issue, self.body)
+
+    def __str__(self):
+        return "comment on {}".format(self.key)
+
+
+class jira_update(jira_action):
+    def __init__(self, issue, **fields):
+        super().__init__(issue)
+        self.fields = fields
+
+    def run(self, jira):
+        self.issue.update(**self.fields)
+
+    def __str__(self):
+        return "update of {} {}".format(self.key, ", ".join(self.fields))
+
+
+class jira_transition(jira_action):
+    def __init__(self, issue, transition):
+        super().__init__(issue)
+        self.transition = transition
+
+    def run(self, jira):
+        jira.transition_issue(self.issue, transition=self.transition)
+
+    def __str__(self):
+        return "transition of {} to {}".format(self.key, self.transition)
+
+
+def run_actions(jira, actions, writes=None):
+    """Queue actions in writes if provided, otherwise run them right away"""
+    if writes:
+        writes.put(*actions)
+        return
+
+    for action in actions:
+        action.run(jira)
+
+
+def retry_after(error):
+    """
+    Return how many seconds JIRA asks to wait before trying again after
+    error, None when it doesn't say
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error):
+    """Whether trying again later may succeed: network errors, 429, 5xx"""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        # requests errors are all OSError
+        return isinstance(error, OSError)
+    return status == 429 or status >= 500
+
+
+def is_rejected(error):
+    """Whether JIRA turned the request down without doing it: 429"""
+    return getattr(error, 'status_code', None) == 429
+
+
+def describe_error(error):
+    """Short description of error, JIRAError text is rather long"""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        return str(error)
+    return "HTTP {} {}".format(status, getattr(error, 'text', '') or '')
+
+
+class jira_write_queue():
+    """
+    Run jira_action objects with up to jobs threads. The actions of an
+    issue run one after the other in the order they were put, when one of
+    them fails the next ones for that issue are dropped. Transient errors
+    are retried up to retries times, only 429 for the actions that aren't
+    idempotent, waiting as long as JIRA asks with Retry-After or an
+    exponential delay
+    """
+
+    def __init__(self, jira, jobs=4, retries=3, delay=2):
+        self.jira = jira
+        self.retries = retries
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.failed = []
+        self.futures = []
+        self.executor = ThreadPoolExecutor(max_workers=max(jobs, 1))
+
+    def put(self, *actions):
+        with self.lock:
+            for action in actions:
+                if action.key in self.pending:
+                    self.pending[action.key].append(action)
+                else:
+                    self.pending[action.key] = deque([action])
+                    self.futures.append(
+                        self.executor.submit(self.run, action.key))
+
+    def run(self, key):
+        while True:
+            with self.lock:
+                actions = self.pending[key]
+                if not actions:
+                    del self.pending[key]
+                    return
+                action = actions.popleft()
+
+            error = self.write(action)
+            if error is None:
+                continue
+
+            with self.lock:
+                self.failed.append((action, error))
+                for skipped in self.pending.pop(key):
+                    self.failed.append(
+                        (skipped, "skipped after the failed {}".format(
+                            action)))
+            return
+
+    def write(self, action):
+        """Run action, return the last error if it didn't succeed"""
+        for attempt in range(self.retries + 1):
+            try:
+                action.run(self.jira)
+                return None
+            except Exception as err:
+                retry = is_transient(err) if action.idempotent \
+                    else is_rejected(err)
+                if attempt == self.retries or not retry:
+                    return err
+                wait = retry_after(err)
+                time.sleep(self.delay * 2 ** attempt if wait is None
+                           else wait)
+
+    def close(self):
+        """
+        Wait for every queued action to be done and return a list of the
+        (action, error) that failed or were dropped, in the order they
+        failed
+        """
+        for future in self.futures:
+            future.result()
+        self.executor.shutdown()
+        return self.failed
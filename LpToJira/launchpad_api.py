@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# Launchpad login shared by the lp-to-jira commands
+
+
+import os
+import atexit
+import threading
+
+from LpToJira.workers import limit_requests
+
+
+thread_sessions = threading.local()
+
+# Default size limit of the Launchpad cache in MiB, can be changed with the
+# LP_TO_JIRA_CACHE_SIZE environment variable
+default_cache_size = 256
+
+
+class lp_cache_stats():
+    """Count the Launchpad GET requests answered from the on-disk cache"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.cache_dirs = set()
+
+    def watch(self, connection):
+        """Count the requests going through an httplib2 connection"""
+        self.cache_dirs.add(connection.cache._cache_dir)
+        request = connection.request
+
+        def counted_request(uri, method="GET", *args, **kwargs):
+            response, content = request(uri, method, *args, **kwargs)
+            if method == "GET":
+                with self.lock:
+                    # Revalidated (304) responses are also from the cache
+                    if response.fromcache:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+            return response, content
+
+        connection.request = counted_request
+
+    def __str__(self):
+        total = self.hits + self.misses
+        return "Launchpad cache: {} hits, {} misses ({:.0f}% hit rate)".format(
+            self.hits, self.misses, 100.0 * self.hits / total if total else 0)
+
+
+cache_stats = lp_cache_stats()
+
+
+def lp_cache_dir():
+    """
+    Return the directory where Launchpad responses are cached, shared by
+    all the lp-to-jira commands
+    """
+    cache_dir = os.getenv("LP_TO_JIRA_CACHE")
+    if cache_dir:
+        return cache_dir
+
+    snap_home = os.getenv("SNAP_USER_COMMON")
+    if snap_home:
+        return "{}/launchpadlib".format(snap_home)
+    return os.path.expanduser("~/.launchpadlib")
+
+
+def evict_cache(cache_dir, max_size):
+    """
+    Remove the least recently written files of cache_dir until it holds no
+    more than max_size bytes. Return the number of files removed
+    """
+    entries = []
+    size = 0
+    for entry in os.scandir(cache_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            size += stat.st_size
+
+    removed = 0
+    for _, file_size, path in sorted(entries):
+        if size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        size -= file_size
+        removed += 1
+
+    return removed
+
+
+def lp_cache_cleanup():
+    """Print the cache statistics and trim the cache to its maximum size"""
+    if not cache_stats.hits + cache_stats.misses:
+        return
+
+    print(cache_stats)
+
+    max_size = int(os.getenv("LP_TO_JIRA_CACHE_SIZE", default_cache_size))
+    for cache_dir in cache_stats.cache_dirs:
+        evict_cache(cache_dir, max_size * 1024 * 1024)
+
+
+def lp_login():
+    """
+    Log into the production Launchpad API and return the session
+    Responses are cached on disk and revalidated with their ETag
+    """
+    # Importing launchpadlib is slow, only do it when Launchpad is needed
+    from launchpadlib.launchpad import Launchpad
+    from launchpadlib.credentials import UnencryptedFileCredentialStore
+
+    # TODO: catch exception if the Launchpad API isn't open
+    snap_home = os.getenv("SNAP_USER_COMMON")
+    if snap_home:
+        credential_store = UnencryptedFileCredentialStore(
+            "{}/.lp_creds".format(snap_home))
+    else:
+        credential_store = UnencryptedFileCredentialStore(
+            os.path.expanduser("~/.lp_creds"))
+
+    lp = Launchpad.login_with(
+        'foundations',
+        'production',
+        launchpadlib_dir=lp_cache_dir(),
+        version='devel',
+        credential_store=credential_store)
+
+    if not cache_stats.cache_dirs:
+        atexit.register(lp_cache_cleanup)
+    cache_stats.watch(lp._browser._connection)
+
+    return lp
+
+
+def thread_lp(max_requests=None):
+    """
+    Return a Launchpad session private to the calling thread, launchpadlib
+    connections can't be shared between threads.
+    max_requests caps the concurrent requests of all those sessions.
+    """
+    lp = getattr(thread_sessions, 'lp', None)
+
+    if lp is None:
+        lp = lp_login()
+        if max_requests:
+            limit_requests(lp._browser._connection, 'launchpad', max_requests)
+        thread_sessions.lp = lp
+
+    return lp
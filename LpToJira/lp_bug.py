@@ -2,6 +2,12 @@
 # Simple LaunchPad Bug object used to store some informations from LaunchPad
 # into a structure that can be stored in and out of a json file
 
+import sys
+import threading
+
+from collections import OrderedDict
+from datetime import datetime
+
 ubuntu_devel = 'Kinetic'
 
 ubuntu_version = {
@@ -18,55 +24,211 @@ ubuntu_version = {
 }
 
 
+# Every status of a bug task, to search for tasks whatever their status
+all_task_statuses = [
+    'New',
+    'Incomplete',
+    'Opinion',
+    'Invalid',
+    'Won\'t Fix',
+    'Expired',
+    'Confirmed',
+    'Triaged',
+    'In Progress',
+    'Deferred',
+    'Fix Committed',
+    'Fix Released',
+    'Does Not Exist'
+]
+
+
+def bug_link_id(link):
+    """Return the bug ID at the end of a Launchpad bug link"""
+    return int(str(link).rstrip("/").split("/")[-1])
+
+
+class code_table():
+    """
+    Small integer codes for the few values a field can take, values not
+    known yet get the next code
+    """
+
+    def __init__(self, values):
+        self.lock = threading.Lock()
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            with self.lock:
+                code = self.codes.setdefault(value, len(self.values))
+                if code == len(self.values):
+                    self.values.append(value)
+        return code
+
+    def value(self, code):
+        return self.values[code]
+
+
+task_statuses = code_table(all_task_statuses)
+task_importances = code_table(
+    ['Undecided', 'Critical', 'High', 'Medium', 'Low', 'Wishlist', 'Unknown'])
+
+
+class task_record():
+    """
+    Status and importance of a bug task as codes of task_statuses and
+    task_importances. Records are read only, all the tasks with the same
+    status and importance share the one get() returns
+    """
+
+    __slots__ = ['status', 'importance']
+
+    records = {}
+
+    def __init__(self, status, importance):
+        self.status = status
+        self.importance = importance
+
+    @classmethod
+    def get(cls, status, importance):
+        key = (task_statuses.code(status), task_importances.code(importance))
+        record = cls.records.get(key)
+        if record is None:
+            record = cls.records.setdefault(key, cls(*key))
+        return record
+
+    def detail(self, detail):
+        if detail == "status":
+            return task_statuses.value(self.status)
+        if detail == "importance":
+            return task_importances.value(self.importance)
+        raise KeyError(detail)
+
+
+def parse_bug_tasks(bug_tasks):
+    """
+    Return the packages of an lp_bug from the tasks of its bug: a dict of
+    the task_record of each serie by package, {'pkg': {'Jammy': record}}.
+    Package and serie names are interned
+    """
+    packages = {}
+    for task in bug_tasks:
+        task_name = task.bug_target_name
+        if " (Ubuntu" in task_name:
+            package_name = sys.intern(task_name.split()[0])
+            package = packages.setdefault(package_name, {})
+
+            # Grab the Ubuntu serie our of the task name
+            # Set the serie to ubuntu_devel is empty
+            serie = task_name[task_name.index("Ubuntu")+7:-1]
+            if serie == '':
+                serie = ubuntu_devel
+            elif serie not in ubuntu_version.keys():
+                continue
+
+            # For each impacted package/serie, capture status and importance
+            package[sys.intern(serie)] = task_record.get(
+                task.status, task.importance)
+
+    return packages
+
+
+def compact_packages(packages_info):
+    """Return the packages of an lp_bug from its packages_info"""
+    return {
+        sys.intern(package): {
+            sys.intern(serie): task_record.get(
+                detail.get("status", ""), detail.get("importance", ""))
+            for serie, detail in info.get("series", {}).items()}
+        for package, info in packages_info.items()}
+
+
 class lp_bug():
-    def __init__(self, id, lp_api):
+    # Fields read from the Launchpad bug the first time they are used
+    bug_fields = ['title', 'description', 'heat', 'date_last_updated']
+
+    def __init__(self, id, lp_api, bug=None):
+        """
+        Gather the information of Launchpad bug id, bug can provide the bug
+        already loaded, for instance with load_bug_snapshot.
+        Only the bug itself is loaded here, its fields are read and its
+        tasks gone through when they are first needed
+        """
         self.id = int(id)
+        self._bug = None
 
         if not lp_api:
             raise ValueError("Error with Launchpad API")
 
-        try:
-            bug = lp_api.bugs[self.id]
+        if bug is None:
+            try:
+                bug = lp_api.bugs[self.id]
 
-        except KeyError:
-            raise KeyError("Bug {} isn't in Launchpad".format(id))
+            except KeyError:
+                raise KeyError("Bug {} isn't in Launchpad".format(id))
 
-        self.title = bug.title
-        self.description = bug.description
-        self.heat = bug.heat
+        self._bug = bug
 
-        self.packages_info = {}
-        for task in bug.bug_tasks:
-            package_name = ""
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Return the lp_bug of a lp_bug_snapshot, no API needed"""
+        bug = cls.__new__(cls)
+        bug.id = int(snapshot.id)
+        bug._bug = snapshot
+        return bug
 
-            task_name = task.bug_target_name
-            if " (Ubuntu" in task_name:
-                package_name = task_name.split()[0]
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild an lp_bug from what dict() returns, without any API.
+        Fields dict(full=False) leaves out are empty
+        """
+        bug = cls.__new__(cls)
+        bug.id = int(data['id'])
+        bug._bug = None
+        bug.title = data['title']
+        bug.packages = compact_packages(data['packages'])
+        bug.description = data.get('description', "")
+        bug.heat = data.get('heat', 0)
 
-                if package_name not in self.packages_info.keys():
-                    self.packages_info[package_name] = {}
+        date_last_updated = data.get('date_last_updated')
+        if date_last_updated:
+            date_last_updated = datetime.fromisoformat(date_last_updated)
+        bug.date_last_updated = date_last_updated
 
-                # Grab the Ubuntu serie our of the task name
-                # Set the serie to ubuntu_devel is empty
-                serie = task_name[task_name.index("Ubuntu")+7:-1]
-                if serie == '':
-                    serie = ubuntu_devel
-                elif serie not in ubuntu_version.keys():
-                    continue
+        return bug
 
-                if "series" not in self.packages_info[package_name].keys():
-                    self.packages_info[package_name]["series"] = {}
+    def __getattr__(self, name):
+        # Only called for the fields not read from the bug yet
+        if name not in self.bug_fields and name != 'packages':
+            raise AttributeError(name)
 
-                if serie not in self.packages_info[package_name]["series"].keys():
-                    self.packages_info[package_name]["series"][serie] = {}
+        bug = self.__dict__.get('_bug')
+        if bug is None:
+            raise AttributeError(name)
 
-                # For each impacted package/serie, capture status
-                self.packages_info[package_name]["series"][serie]["status"]\
-                    = task.status
+        if name in self.bug_fields:
+            value = getattr(bug, name)
+        else:
+            value = parse_bug_tasks(bug.bug_tasks)
 
-                # For each impacted package/serie, capture importance
-                self.packages_info[package_name]["series"][serie]["importance"]\
-                    = task.importance
+        setattr(self, name, value)
+        return value
+
+    @property
+    def packages_info(self):
+        """
+        The packages of the bug as nested dicts, as they are in dict():
+        {'pkg': {'series': {'Jammy': {'status': .., 'importance': ..}}}}
+        """
+        return {
+            package: {'series': {
+                serie: {'status': record.detail("status"),
+                        'importance': record.detail("importance")}
+                for serie, record in series.items()}} if series else {}
+            for package, series in self.packages.items()}
 
     @property
     def affected_packages(self):
@@ -74,15 +236,15 @@ class lp_bug():
         return list of packages affected by this bug in a form of string list
         ['pkg1', 'pkg2' , 'pkg3']
         """
-        return list(self.packages_info.keys())
+        return list(self.packages.keys())
 
     def affected_series(self, package):
         """
         Returns a list of string containing the series affected by a specific
         bug for a specific package: ['Impish', 'Focal', 'Bionic']
         """
-        if package in self.packages_info.keys():
-            return list(self.packages_info[package]['series'].keys())
+        if package in self.packages.keys():
+            return list(self.packages[package].keys())
         return []
 
     def affected_versions(self, package):
@@ -94,7 +256,7 @@ class lp_bug():
 
     def package_detail(self, package, serie, detail):
         try:
-            return self.packages_info[package]["series"][serie][detail]
+            return self.packages[package][serie].detail(detail)
         except KeyError:
             return ""
 
@@ -116,12 +278,90 @@ class lp_bug():
 
         return string
 
-    def dict(self):
+    def dict(self, full=False):
+        """
+        Return the bug as a dict, full adds what from_dict() needs to
+        rebuild all of it
+        """
         dict = {}
         dict['id'] = self.id
         dict['title'] = self.title
         dict['packages'] = self.packages_info
 
+        if full:
+            dict['description'] = self.description
+            dict['heat'] = self.heat
+            dict['date_last_updated'] = \
+                self.date_last_updated.isoformat() \
+                if self.date_last_updated else None
+
         return dict
 
+
+class lp_bug_cache():
+    """
+    The lp_bug of the most recently used bugs, by bug ID and the
+    date_last_updated they were built from, up to size bugs
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.lock = threading.Lock()
+        self.bugs = OrderedDict()
+        self.latest = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, id, lp_api, bug=None):
+        """
+        Return the lp_bug of bug id, bug is the already loaded bug as for
+        lp_bug(). Without it the lp_bug last built for id is returned,
+        the bug being loaded only if there's none
+        """
+        id = int(id)
+
+        with self.lock:
+            if bug is None:
+                key = self.latest.get(id)
+            else:
+                key = (id, bug.date_last_updated)
+
+            cached = self.bugs.get(key)
+            if cached is not None:
+                self.bugs.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        new_bug = lp_bug(id, lp_api, bug)
+        key = (id, new_bug.date_last_updated)
+
+        with self.lock:
+            self.bugs[key] = new_bug
+            self.bugs.move_to_end(key)
+            self.latest[id] = key
+
+            while len(self.bugs) > self.size:
+                old_key, _ = self.bugs.popitem(last=False)
+                if self.latest.get(old_key[0]) == old_key:
+                    del self.latest[old_key[0]]
+
+        return new_bug
+
+    def clear(self):
+        with self.lock:
+            self.bugs.clear()
+            self.latest.clear()
+
+    def __str__(self):
+        total = self.hits + self.misses
+        return "Launchpad bug cache: {} hits, {} misses " \
+            "({:.0f}% hit rate)".format(
+                self.hits, self.misses,
+                100.0 * self.hits / total if total else 0)
+
+
+# Where the report and the sync get their lp_bug from
+lp_bugs = lp_bug_cache()
+
 # =============================================================================
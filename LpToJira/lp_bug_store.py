@@ -0,0 +1,275 @@
+#!/usr/bin/python3
+# Keep lp_bug objects on disk for offline reports: an append only file of
+# bugs with a fixed width index, both read through mmap so a single bug is
+# found and decoded without reading the rest
+
+
+import os
+import json
+import mmap
+import struct
+import threading
+
+from LpToJira.lp_bug import lp_bug
+
+
+# Index header: magic, generation shared with the data file, number of
+# entries sorted by bug ID at the start of the index
+index_header = struct.Struct("<8sQQ")
+index_magic = b"LPBUGIX1"
+
+# Index entry: bug ID, offset and length of its record in the data file
+index_entry = struct.Struct("<QQI")
+
+# The data file starts with this line, then has one JSON record per line
+data_header = "LPBUGS1 {:016x}\n"
+
+
+class lp_bug_store():
+    """
+    Snapshot of Launchpad bugs in the file path, with its index in
+    path.idx. Bugs are appended as they are updated, the newest record of
+    a bug being the one returned. compact() rewrites both files with only
+    the newest records and all the index sorted by bug ID, get() looks the
+    sorted part up with a binary search in the mapped index and the
+    entries appended since in memory
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.index_path = self.path + ".idx"
+        self.lock = threading.Lock()
+        self.data_map = None
+        self.index_map = None
+
+        if not os.path.exists(self.path):
+            self.create(self.path, self.index_path, os.urandom(8))
+
+        self.open()
+
+    @staticmethod
+    def create(path, index_path, generation):
+        generation = int.from_bytes(generation, "little")
+        with open(path, "w") as data_file:
+            data_file.write(data_header.format(generation))
+        with open(index_path, "wb") as index_file:
+            index_file.write(index_header.pack(index_magic, generation, 0))
+
+    def open(self):
+        self.data_file = open(self.path, "r+b")
+        header = self.data_file.readline().decode()
+        if not self.index_matches(header):
+            # compact() stopped between replacing the two files, the data
+            # file has everything the index needs
+            self.rebuild_index()
+
+        self.index_file = open(self.index_path, "r+b")
+        _, _, self.sorted = index_header.unpack(
+            self.index_file.read(index_header.size))
+
+        # Entries appended since the last compaction
+        self.appended = {}
+        start = index_header.size + self.sorted * index_entry.size
+        self.index_file.seek(start)
+        entries = self.index_file.read()
+        partial = len(entries) % index_entry.size
+        if partial:
+            # An append stopped half way, that bug is appended again later
+            entries = entries[:-partial]
+            self.index_file.truncate(start + len(entries))
+        for bug_id, offset, length in index_entry.iter_unpack(entries):
+            self.appended[bug_id] = (offset, length)
+
+        self.data_file.seek(0, os.SEEK_END)
+        self.index_file.seek(0, os.SEEK_END)
+
+    def index_matches(self, header):
+        """Whether the index was written for the data file with header"""
+        try:
+            with open(self.index_path, "rb") as index_file:
+                magic, generation, _ = index_header.unpack(
+                    index_file.read(index_header.size))
+        except (OSError, struct.error):
+            return False
+        return magic == index_magic and \
+            header == data_header.format(generation)
+
+    def rebuild_index(self):
+        """
+        Write the whole index again from the data file, every record being
+        appended. A record cut short at the end of the file is dropped
+        """
+        self.data_file.seek(0)
+        header = self.data_file.readline().decode()
+        try:
+            generation = int(header.split()[1], 16)
+            if header != data_header.format(generation):
+                raise ValueError(header)
+        except (IndexError, ValueError):
+            raise ValueError("{} isn't a bug store".format(self.path))
+
+        entries = []
+        offset = self.data_file.tell()
+        for record in self.data_file:
+            if not record.endswith(b"\n"):
+                break
+            entries.append(index_entry.pack(
+                json.loads(record)['id'], offset, len(record)))
+            offset += len(record)
+        self.data_file.truncate(offset)
+
+        with open(self.index_path, "wb") as index_file:
+            index_file.write(index_header.pack(index_magic, generation, 0))
+            index_file.write(b"".join(entries))
+
+    def close(self):
+        with self.lock:
+            self.unmap()
+            self.data_file.close()
+            self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def unmap(self):
+        for mapped in [self.data_map, self.index_map]:
+            if mapped is not None:
+                mapped.close()
+        self.data_map = None
+        self.index_map = None
+
+    def map(self):
+        if self.data_map is None:
+            self.data_map = mmap.mmap(
+                self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.index_map = mmap.mmap(
+                self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def find_sorted(self, bug_id):
+        """Binary search of bug_id in the sorted part of the index"""
+        low, high = 0, self.sorted
+        while low < high:
+            middle = (low + high) // 2
+            entry_id, offset, length = index_entry.unpack_from(
+                self.index_map, index_header.size + middle * index_entry.size)
+            if entry_id == bug_id:
+                return offset, length
+            if entry_id < bug_id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def locate(self, bug_id):
+        location = self.appended.get(bug_id)
+        if location is None and self.sorted:
+            self.map()
+            location = self.find_sorted(bug_id)
+        return location
+
+    def get(self, bug_id):
+        """Return the lp_bug of bug_id, KeyError if it isn't stored"""
+        bug_id = int(bug_id)
+        with self.lock:
+            location = self.locate(bug_id)
+            if location is None:
+                raise KeyError("Bug {} isn't in {}".format(bug_id, self.path))
+
+            self.map()
+            offset, length = location
+            record = self.data_map[offset:offset + length]
+
+        return lp_bug.from_dict(json.loads(record))
+
+    def __contains__(self, bug_id):
+        with self.lock:
+            return self.locate(int(bug_id)) is not None
+
+    def ids(self):
+        """Every bug ID in the store, sorted"""
+        with self.lock:
+            self.map()
+            ids = set(self.appended)
+            ids.update(
+                entry_id for entry_id, _, _ in index_entry.iter_unpack(
+                    self.index_map[
+                        index_header.size:
+                        index_header.size + self.sorted * index_entry.size]))
+        return sorted(ids)
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __iter__(self):
+        for bug_id in self.ids():
+            yield self.get(bug_id)
+
+    def append(self, bug):
+        """
+        Add bug at the end, unless the one stored for the same ID has the
+        same date_last_updated. Return whether bug was added
+        """
+        if bug.id in self and \
+                self.get(bug.id).date_last_updated == bug.date_last_updated:
+            return False
+
+        record = json.dumps(bug.dict(full=True)).encode() + b"\n"
+
+        with self.lock:
+            # The mapped files are about to grow
+            self.unmap()
+            offset = self.data_file.tell()
+            self.data_file.write(record)
+            self.data_file.flush()
+
+            # The index is written once the record is there
+            self.index_file.write(
+                index_entry.pack(bug.id, offset, len(record)))
+            self.index_file.flush()
+            self.appended[bug.id] = (offset, len(record))
+
+        return True
+
+    @property
+    def needs_compaction(self):
+        """Whether lookups would be faster after compact()"""
+        return len(self.appended) > max(1000, self.sorted // 4)
+
+    def compact(self):
+        """
+        Rewrite the store with the newest record of each bug and the whole
+        index sorted, the files are replaced once the new ones are ready
+        """
+        new_path = self.path + ".new"
+        new_index_path = self.index_path + ".new"
+        bug_ids = self.ids()
+
+        with self.lock:
+            self.map()
+            self.create(new_path, new_index_path, os.urandom(8))
+            with open(new_path, "ab") as data_file, \
+                    open(new_index_path, "r+b") as index_file:
+                magic, generation, _ = index_header.unpack(
+                    index_file.read(index_header.size))
+                for bug_id in bug_ids:
+                    offset, length = self.locate(bug_id)
+                    index_file.write(index_entry.pack(
+                        bug_id, data_file.tell(), length))
+                    data_file.write(self.data_map[offset:offset + length])
+                index_file.seek(0)
+                index_file.write(
+                    index_header.pack(magic, generation, len(bug_ids)))
+
+            self.unmap()
+            self.data_file.close()
+            self.index_file.close()
+
+            # The generation in both headers tells if a crash happened
+            # between these two, open() rebuilds the index then
+            os.replace(new_path, self.path)
+            os.replace(new_index_path, self.index_path)
+
+            self.open()
@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+# Local SQLite database remembering which JIRA issue each Launchpad bug was
+# imported as, shared by lp-to-jira, lp-to-jira-report and the monitor
+
+
+import os
+import sqlite3
+import datetime
+
+from LpToJira.jira_api import issue_search
+
+
+# JIRA statuses of the issues lp-to-jira keeps an eye on
+active_statuses = ["BLOCKED",
+                   "Backlog",
+                   "In Progress",
+                   "REVIEW",
+                   "Selected for Development"]
+
+# How often refresh() fetches every issue of a project again, to forget the
+# ones deleted or moved out of the project
+full_refresh_age = datetime.timedelta(days=1)
+
+
+def get_bug_id(summary):
+    "Extract the bug id from a jira title whivh would icnlude LP#"
+    id = ""
+
+    if "LP#" in summary:
+        for char in summary[summary.find("LP#")+3:]:
+            if char.isdigit():
+                id = id + char
+            else:
+                break
+
+    return id
+
+
+def default_db_path():
+    snap_home = os.getenv("SNAP_USER_COMMON")
+    if snap_home:
+        return "{}/lp_to_jira.db".format(snap_home)
+    return os.path.expanduser("~/.lp_to_jira.db")
+
+
+class lp_jira_db():
+    """
+    Launchpad bug <-> JIRA issue mapping of JIRA projects, with the JIRA
+    summary, status and labels of the issue, the last time the bug changed in
+    Launchpad and when the entry was last synced
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_db_path()
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS issues (
+                jira_key TEXT PRIMARY KEY,
+                project TEXT NOT NULL,
+                bug_id INTEGER NOT NULL,
+                summary TEXT,
+                jira_status TEXT,
+                labels TEXT,
+                lp_updated TEXT,
+                synced TEXT
+            );
+            CREATE INDEX IF NOT EXISTS issues_bug
+                ON issues (project, bug_id);
+            CREATE TABLE IF NOT EXISTS projects (
+                project TEXT PRIMARY KEY,
+                refreshed TEXT,
+                full_refresh TEXT
+            );
+            CREATE TABLE IF NOT EXISTS watermarks (
+                scope TEXT PRIMARY KEY,
+                since TEXT
+            );
+        """)
+
+        # Databases created before full refreshes
+        columns = [row['name'] for row in
+                   self.db.execute("PRAGMA table_info(projects)")]
+        if "full_refresh" not in columns:
+            self.db.execute(
+                "ALTER TABLE projects ADD COLUMN full_refresh TEXT")
+
+        # Databases created before labels were kept, the next refresh
+        # fetches every issue again to get them
+        columns = [row['name'] for row in
+                   self.db.execute("PRAGMA table_info(issues)")]
+        if "labels" not in columns:
+            self.db.execute("ALTER TABLE issues ADD COLUMN labels TEXT")
+            self.db.execute("UPDATE projects SET full_refresh = NULL")
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def refreshed(self, project):
+        """Return when project was last refreshed from JIRA, None if never"""
+        row = self.db.execute(
+            "SELECT refreshed FROM projects WHERE project = ?",
+            (project,)).fetchone()
+        if not row:
+            return None
+        return datetime.datetime.fromisoformat(row[0])
+
+    def full_refreshed(self, project):
+        """Return when all of project was last fetched, None if never"""
+        row = self.db.execute(
+            "SELECT full_refresh FROM projects WHERE project = ?",
+            (project,)).fetchone()
+        if not row or not row[0]:
+            return None
+        return datetime.datetime.fromisoformat(row[0])
+
+    def refresh(self, jira, project, full=False, incremental=False):
+        """
+        Fetch the LP# issues of project changed in JIRA since the last
+        refresh. All of them are fetched the first time, with full or when
+        the last full refresh is older than full_refresh_age unless
+        incremental, and the issues JIRA didn't return are forgotten,
+        provided the search surely went through all of them. Return how
+        many were fetched
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        request = "project = \"{}\" AND summary ~ \"LP#\"".format(project)
+
+        refreshed = self.refreshed(project)
+        full_refreshed = self.full_refreshed(project)
+        full = full or not refreshed or not incremental and (
+            not full_refreshed or now - full_refreshed > full_refresh_age)
+        if not full:
+            # Relative dates don't depend on the timezone JIRA is using,
+            # JIRA only has a minute precision so go one minute earlier
+            minutes = int((now - refreshed).total_seconds() // 60) + 1
+            request += " AND updated >= -{}m".format(minutes)
+
+        fetched = set()
+        search = issue_search(
+            jira, request, fields=["summary", "status", "labels"])
+        for issue in search:
+            bug_id = get_bug_id(issue.fields.summary)
+            if bug_id:
+                self.add_issue(
+                    project, int(bug_id), issue.key,
+                    issue.fields.summary, issue.fields.status.name,
+                    issue.fields.labels, commit=False)
+                fetched.add(issue.key)
+
+        if full and search.complete:
+            # Deleted, moved to another project or not LP# anymore
+            gone = [
+                (jira_key,) for jira_key, in self.db.execute(
+                    "SELECT jira_key FROM issues WHERE project = ?",
+                    (project,))
+                if jira_key not in fetched]
+            self.db.executemany(
+                "DELETE FROM issues WHERE jira_key = ?", gone)
+            full_refreshed = now
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO projects VALUES (?, ?, ?)",
+            (project, now.isoformat(),
+             full_refreshed.isoformat() if full_refreshed else None))
+        self.db.commit()
+
+        return len(fetched)
+
+    def add_issue(self, project, bug_id, jira_key, summary=None,
+                  jira_status=None, labels=None, commit=True):
+        """Record that bug_id is tracked in project by jira_key"""
+        # JIRA labels can't have spaces
+        if labels is not None:
+            labels = " ".join(labels)
+
+        self.db.execute("""
+            INSERT INTO issues (jira_key, project, bug_id, summary,
+                                jira_status, labels)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (jira_key) DO UPDATE SET
+                project = excluded.project,
+                bug_id = excluded.bug_id,
+                summary = coalesce(excluded.summary, summary),
+                jira_status = coalesce(excluded.jira_status, jira_status),
+                labels = coalesce(excluded.labels, labels)
+            """, (jira_key, project, bug_id, summary, jira_status, labels))
+        if commit:
+            self.db.commit()
+
+    def set_lp_updated(self, jira_key, lp_updated, commit=True):
+        """Record the last time the bug of jira_key changed in Launchpad"""
+        self.db.execute(
+            "UPDATE issues SET lp_updated = ?, synced = ? WHERE jira_key = ?",
+            ("%s" % lp_updated,
+             datetime.datetime.now(datetime.timezone.utc).isoformat(),
+             jira_key))
+        if commit:
+            self.db.commit()
+
+    def watermark(self, scope):
+        """
+        Return the time the last complete sync of scope started, None if
+        there was none
+        """
+        row = self.db.execute(
+            "SELECT since FROM watermarks WHERE scope = ?",
+            (scope,)).fetchone()
+        if not row:
+            return None
+        return datetime.datetime.fromisoformat(row[0])
+
+    def set_watermark(self, scope, since):
+        """Record since as the start of the last complete sync of scope"""
+        previous = self.watermark(scope)
+        # The watermark never goes backward
+        if previous and previous >= since:
+            return
+        self.db.execute(
+            "INSERT OR REPLACE INTO watermarks VALUES (?, ?)",
+            (scope, since.isoformat()))
+        self.db.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def index(self, project):
+        """Return a {bug_id: jira_key} dict of the bugs imported in project"""
+        index = {}
+        for bug_id, jira_key in self.db.execute(
+                "SELECT bug_id, jira_key FROM issues WHERE project = ? "
+                "ORDER BY rowid", (project,)):
+            index.setdefault(bug_id, jira_key)
+        return index
+
+    def issues(self, project, statuses=None):
+        """
+        Return the entries of project as sqlite3.Row with bug_id, jira_key,
+        summary, jira_status, labels (space separated, None until a refresh
+        got them), lp_updated and synced columns, only those with a JIRA
+        status in statuses if provided
+        """
+        rows = self.db.execute(
+            "SELECT * FROM issues WHERE project = ? ORDER BY rowid",
+            (project,)).fetchall()
+
+        if statuses is None:
+            return rows
+
+        # JIRA status names are case insensitive in JQL
+        statuses = [status.lower() for status in statuses]
+        return [row for row in rows
+                if row['jira_status'] and
+                row['jira_status'].lower() in statuses]
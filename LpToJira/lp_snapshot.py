@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# Load a Launchpad bug and all its tasks as plain data in as few requests
+# as possible, rather than walking launchpadlib objects attribute by
+# attribute
+
+
+import json
+import threading
+
+from datetime import datetime
+
+
+# Largest page Launchpad serves for a collection
+task_page_size = 300
+
+
+class lp_task_snapshot():
+    """The parts of a Launchpad bug task lp-to-jira looks at"""
+
+    __slots__ = ['bug_target_name', 'status', 'importance']
+
+    def __init__(self, bug_target_name, status, importance):
+        self.bug_target_name = bug_target_name
+        self.status = status
+        self.importance = importance
+
+
+class lp_bug_snapshot():
+    """
+    Plain copy of a Launchpad bug and its tasks. It has the same attributes
+    as the launchpadlib bug for what lp-to-jira reads, bug_tasks included,
+    and requests tells how many requests were needed to load it
+    """
+
+    def __init__(self, bug, tasks, requests=0):
+        self.id = bug['id']
+        self.title = bug['title']
+        self.description = bug['description']
+        self.heat = bug['heat']
+        self.tags = bug['tags']
+        self.web_link = bug['web_link']
+        self.bug_link = bug['self_link']
+        self.date_last_updated = datetime.fromisoformat(
+            bug['date_last_updated'])
+        self.bug_tasks = [
+            lp_task_snapshot(
+                task['bug_target_name'],
+                task['status'],
+                task['importance'])
+            for task in tasks]
+        self.requests = requests
+
+
+class lp_request_counter():
+    """Count the requests sent by load_bug_snapshot"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bugs = 0
+
+    def add(self, requests):
+        with self.lock:
+            self.requests += requests
+            self.bugs += 1
+
+    def __str__(self):
+        return "{} Launchpad requests for {} bugs".format(
+            self.requests, self.bugs)
+
+
+snapshot_requests = lp_request_counter()
+
+
+def load_bug_snapshot(lp_api, bug_id):
+    """
+    Return a lp_bug_snapshot of bug_id, fetching the bug then its whole
+    task collection in pages of task_page_size tasks: two requests for
+    almost every bug
+    """
+    from lazr.restfulclient.errors import NotFound
+
+    browser = lp_api._browser
+    requests = 0
+
+    try:
+        bug = json.loads(browser.get(
+            str(lp_api._root_uri.append("bugs/{}".format(int(bug_id))))))
+        requests += 1
+    except NotFound:
+        raise KeyError("Bug {} isn't in Launchpad".format(bug_id))
+
+    tasks = []
+    link = "{}?ws.size={}".format(
+        bug['bug_tasks_collection_link'], task_page_size)
+    while link:
+        page = json.loads(browser.get(link))
+        requests += 1
+        tasks += page['entries']
+        link = page.get('next_collection_link')
+
+    snapshot_requests.add(requests)
+
+    return lp_bug_snapshot(bug, tasks, requests)
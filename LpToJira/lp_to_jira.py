@@ -3,17 +3,22 @@
 # create a new Entry in JIRA in a given project
 
 
-import os
+import json
 import argparse
 import textwrap
 
-from datetime import datetime, timedelta
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import partial
 
-from launchpadlib.launchpad import Launchpad
-from launchpadlib.credentials import UnencryptedFileCredentialStore
-
-from jira import JIRA, JIRAError
-from LpToJira.jira_api import jira_api
+from LpToJira.jira_api import \
+    jira_connect, jira_init_error, lazy_api, search_all_issues
+from LpToJira.launchpad_api import lp_login, thread_lp
+from LpToJira.lp_bug import bug_link_id
+from LpToJira.lp_snapshot import load_bug_snapshot
+from LpToJira.lp_writeback import lp_bug_update, lp_writeback_queue
+from LpToJira.lp_jira_db import get_bug_id, default_db_path, lp_jira_db
+from LpToJira.workers import limit_requests, run_ordered
 
 
 # TODO: paramaterize this, for now we just hardcode
@@ -36,6 +41,12 @@ pkg_to_component = {
     "fce-templates": "FCE Templates",
 }
 
+# Maximum number of issues JIRA accepts in a single bulk create request
+jira_bulk_size = 50
+
+# Bug to import from a saved plan, loaded from Launchpad only when needed
+planned_bug = namedtuple('planned_bug', ['id', 'web_link', 'bug_link'])
+
 
 def get_lp_bug(lp, bug_number):
     """Make sure the bug ID exists, return bug"""
@@ -73,9 +84,11 @@ def get_lp_bug_pkg(bug):
     return bug_pkg
 
 
-def get_all_lp_project_bug_tasks(lp, project, days=None, tags=None):
+def get_all_lp_project_bug_tasks(lp, project, days=None, tags=None,
+                                 modified_since=None):
     """Return iterable IBugTasks of all Bugs in a Project filed in the past n
-    days. If days is not specified, return all Bugs."""
+    days. If days is not specified, return all Bugs.
+    modified_since limits the search to the tasks changed since then"""
 
     try:
         lp_project = lp.projects[project]
@@ -88,8 +101,12 @@ def get_all_lp_project_bug_tasks(lp, project, days=None, tags=None):
     if days:
         created_since = (datetime.now() - timedelta(days)).strftime('%Y-%m-%d')
 
+    if modified_since:
+        modified_since = modified_since.isoformat()
+
     bug_tasks = lp_project.searchTasks(
         created_since=created_since,
+        modified_since=modified_since,
         status=[
             'New',
             'Incomplete',
@@ -108,18 +125,56 @@ def get_all_lp_project_bug_tasks(lp, project, days=None, tags=None):
     return bug_tasks
 
 
-def is_bug_in_jira(jira, bug, project_id):
-    """Checks Jira for the same ID as the Bug you're trying to import"""
+def get_jira_bug_index(jira, project_id, db=None, batch=1000,
+                       incremental=False):
+    """
+    Return a dict mapping every Launchpad bug ID imported in project_id to
+    the key of its JIRA issue, {1234567: 'FR-123', ...}
+    The project is searched once, in pages of up to batch issues, unless db
+    (see lp_jira_db) is provided in which case only the changes are fetched,
+    never the whole project with incremental once db knows about it
+    """
+
+    if db:
+        db.refresh(jira, project_id, incremental=incremental)
+        return db.index(project_id)
+
+    index = {}
 
-    existing_issue = jira.search_issues(
-        "project = \"{}\" AND summary ~ \"LP#{}\"".format(project_id, bug.id))
+    for issue in search_all_issues(
+            jira,
+            "project = \"{}\" AND summary ~ \"LP#\"".format(project_id),
+            fields="summary",
+            batch=batch):
+        # The JQL text search is fuzzy, only trust the parsed LP#
+        bug_id = get_bug_id(issue.fields.summary)
+        if bug_id:
+            index.setdefault(int(bug_id), issue.key)
+
+    return index
+
+
+def is_bug_in_jira(jira, bug, project_id, index=None):
+    """
+    Checks Jira for the same ID as the Bug you're trying to import
+    If index is provided (see get_jira_bug_index) it is used instead of
+    searching JIRA
+    """
+
+    if index is not None:
+        issue_key = index.get(bug.id)
+    else:
+        existing_issue = jira.search_issues(
+            "project = \"{}\" AND summary ~ \"LP#{}\"".format(
+                project_id, bug.id))
+        issue_key = existing_issue[0].key if existing_issue else None
 
-    if existing_issue:
+    if issue_key:
         print("Launchpad Issue {} is already logged "
               "in JIRA here {}/browse/{}".format(
                   bug.id,
                   jira.client_info(),
-                  existing_issue[0].key))
+                  issue_key))
         return True
     return False
 
@@ -150,6 +205,16 @@ def build_jira_issue(lp, bug, project_id, opts=None):
     return issue_dict
 
 
+def lp_link(bug):
+    """Return the JIRA remote link object pointing at a Launchpad bug"""
+
+    return {
+        'url': bug.web_link,
+        'title': 'Launchpad Link',
+        'icon': {'url16x16': 'https://bugs.launchpad.net/favicon.ico'}
+    }
+
+
 def create_jira_issue(jira, issue_dict, bug, opts=None):
     """Create and return a Jira Issue from issue_dict"""
 
@@ -157,12 +222,12 @@ def create_jira_issue(jira, issue_dict, bug, opts=None):
     new_issue = jira.create_issue(fields=issue_dict)
 
     # Adding a link to the Launchpad bug into the JIRA entry
-    link = {'url': bug.web_link, 'title': 'Launchpad Link', 'icon': {'url16x16': 'https://bugs.launchpad.net/favicon.ico'}}
-    jira.add_simple_link(new_issue, object=link)
+    jira.add_simple_link(new_issue, object=lp_link(bug))
 
     print("Created {}/browse/{}".format(jira.client_info(), new_issue.key))
 
     if opts and opts.epic:
+        from jira import JIRAError
         try:
             jira.add_issues_to_epic(opts.epic, [new_issue.id])
             print("Added to Epic %s" % opts.epic)
@@ -172,28 +237,336 @@ def create_jira_issue(jira, issue_dict, bug, opts=None):
     return new_issue
 
 
-def lp_to_jira_bug(lp, jira, bug, project_id, opts):
-    """Create JIRA issue at project_id for a given Launchpad bug"""
+def create_jira_issues(jira, pending, opts=None, jobs=4):
+    """
+    Bulk create the Jira Issues of pending, a list of (bug, issue_dict)
+    sharing the same project, in a single request.
+    Return a list of (bug, new_issue, error) in the order of pending,
+    new_issue is None and error explains why if JIRA refused an issue,
+    or the whole request failed.
+    """
 
-    if is_bug_in_jira(jira, bug, project_id):
-        return
+    if not pending:
+        return []
+
+    from jira import JIRAError
+
+    try:
+        # Resolve the project once, JIRA would look it up for every issue
+        project = jira.project(pending[0][1]['project'])
+        field_list = [
+            dict(issue_dict, project={'id': project.id})
+            for _, issue_dict in pending]
+        created_list = jira.create_issues(field_list, prefetch=False)
+    except (JIRAError, OSError) as err:
+        # requests errors are OSError, nothing was created
+        return [(bug, None, err) for bug, _ in pending]
+
+    results = []
+    for (bug, _), created in zip(pending, created_list):
+        if created['status'] == 'Success':
+            results.append((bug, created['issue'], None))
+        else:
+            results.append((bug, None, created['error']))
+
+    new_issues = [(bug, issue) for bug, issue, _ in results if issue]
+
+    # Adding a link to the Launchpad bug into the JIRA entries
+    for (bug, new_issue), _, error in run_ordered(
+            lambda created: jira.add_simple_link(
+                created[1], object=lp_link(created[0])),
+            new_issues,
+            jobs):
+        print("Created {}/browse/{}".format(jira.client_info(), new_issue.key))
+        if error:
+            print("Failed to link {} to LP#{}:\n{}".format(
+                new_issue.key, bug.id, error))
+
+    if opts and opts.epic and new_issues:
+        try:
+            jira.add_issues_to_epic(
+                opts.epic, [issue.id for _, issue in new_issues])
+            print("Added {} issues to Epic {}".format(
+                len(new_issues), opts.epic))
+        except JIRAError as err:
+            print("Failed to add to Epic {0}:\n{1}".format(opts.epic, err))
+
+    return results
+
+
+def get_jira_issue_dict(lp, jira, bug, project_id, opts, index=None):
+    """
+    Return the dict to create the Jira Issue of a Launchpad bug with the
+    requested label, None if the bug is already in project_id
+    """
+
+    if is_bug_in_jira(jira, bug, project_id, index):
+        return None
 
     issue_dict = build_jira_issue(lp, bug, project_id, opts)
     if opts.label:
         # Add labels if specified
         issue_dict["labels"] = [opts.label]
 
-    jira_issue = create_jira_issue(jira, issue_dict, bug, opts)
+    return issue_dict
+
+
+def update_lp_bug(bug, jira_issue, opts, writeback=None):
+    """
+    Add references to the new JIRA issue into the Launchpad bug, saved at
+    once or by the writeback queue if provided
+    """
+
+    update = lp_bug_update(bug)
 
     if opts.lp_link:
         # Add reference to the JIRA entry in the bugs on Launchpad
-        bug.description += '\n\n---\nExternal link: https://warthogs.atlassian.net/browse/'+jira_issue.key
-        bug.lp_save()
+        update.append_description(
+            '\n\n---\nExternal link: https://warthogs.atlassian.net/browse/'
+            + jira_issue.key)
 
     if not opts.no_lp_tag:
         # Add reference to the JIRA entry in the bugs on Launchpad
-        bug.tags += [jira_issue.key.lower()]
-        bug.lp_save()
+        update.add_tag(jira_issue.key.lower())
+
+    if writeback:
+        writeback.put(update)
+    else:
+        update.save()
+
+
+def sync_scope(opts):
+    """
+    Name what --sync_project_bugs looks at, the incremental sync watermark
+    is only valid for that same set of bugs
+    """
+    scope = "{} -> {} tags:{}".format(
+        opts.sync_project_bugs,
+        opts.project,
+        ",".join(sorted(opts.tags or [])))
+    # Only the bugs created in the last days were looked at
+    if opts.days:
+        scope += " days:{}".format(opts.days)
+    return scope
+
+
+def lp_to_jira_bug(lp, jira, bug, project_id, opts, index=None):
+    """
+    Create JIRA issue at project_id for a given Launchpad bug and return it,
+    None if the bug was already imported
+    The new issue is recorded in index when one is provided
+    """
+
+    issue_dict = get_jira_issue_dict(lp, jira, bug, project_id, opts, index)
+    if issue_dict is None:
+        return None
+
+    jira_issue = create_jira_issue(jira, issue_dict, bug, opts)
+
+    if index is not None:
+        index[bug.id] = jira_issue.key
+
+    update_lp_bug(bug, jira_issue, opts)
+
+    return jira_issue
+
+
+def get_jira_issue_task(bug_task, lp, jira, project_id, opts, index=None):
+    """
+    Return (bug, issue_dict) for the bug of a Launchpad bug task, bug being
+    a lp_bug_snapshot and issue_dict None if it is already in project_id
+    When running with several jobs the bug is loaded through a Launchpad
+    session belonging to the current thread
+    """
+
+    if opts.jobs > 1:
+        lp = thread_lp(opts.max_per_host)
+
+    bug = load_bug_snapshot(lp, bug_link_id(bug_task.bug_link))
+
+    return bug, get_jira_issue_dict(lp, jira, bug, project_id, opts, index)
+
+
+def plan_project_sync(lp, jira, opts, db=None, filtered=False):
+    """
+    Work out what --sync_project_bugs would do without changing anything.
+    Return (plan, bugs), plan being a dict that can be saved as json and
+    given to apply_plan, bugs the {bug_id: bug} of the bugs to import.
+    None is returned for the plan if the LP project doesn't exist.
+    With filtered the plan lists the bugs --tags left out, which takes a
+    second search of the whole project
+    """
+
+    modified_since = None
+    if opts.incremental:
+        modified_since = db.watermark(sync_scope(opts))
+    sync_started = datetime.now(timezone.utc)
+
+    tasks_list = get_all_lp_project_bug_tasks(
+        lp, opts.sync_project_bugs, opts.days, opts.tags, modified_since)
+    if tasks_list is None:
+        return None, {}
+
+    # Look up every issue already imported once rather than per bug
+    index = get_jira_bug_index(jira, opts.project, db)
+
+    if opts.jobs > 1:
+        limit_requests(jira._session, 'jira', opts.max_per_host)
+
+    # A bug can have several tasks in a project, import it only once
+    bug_tasks = list({
+        bug_task.bug_link: bug_task for bug_task in tasks_list}.values())
+
+    plan = {
+        'lp_project': opts.sync_project_bugs,
+        'project': opts.project,
+        'created': sync_started.isoformat(),
+        'options': {
+            'epic': opts.epic,
+            'lp_link': opts.lp_link,
+            'no_lp_tag': opts.no_lp_tag,
+        },
+        'create': [],
+        'skip': [],
+        'filtered': [],
+        'failed': [],
+        'watermark': None,
+    }
+    bugs = {}
+
+    for bug_task, result, error in run_ordered(
+            partial(get_jira_issue_task, lp=lp, jira=jira,
+                    project_id=opts.project, opts=opts, index=index),
+            bug_tasks,
+            opts.jobs):
+        bug_id = bug_link_id(bug_task.bug_link)
+        if error:
+            print("Failed to import Launchpad bug {}: {}".format(
+                bug_id, error))
+            plan['failed'].append({'bug': bug_id, 'error': str(error)})
+            continue
+
+        bug, issue_dict = result
+        if issue_dict is None:
+            plan['skip'].append({'bug': bug.id, 'jira': index.get(bug.id)})
+            continue
+
+        bugs[bug.id] = bug
+        plan['create'].append({
+            'bug': bug.id,
+            'bug_link': bug_task.bug_link,
+            'web_link': bug.web_link,
+            'issue': issue_dict,
+        })
+
+    if filtered and opts.tags:
+        # Tags are filtered by Launchpad, the search without them tells
+        # which bugs were left out
+        wanted = set(task.bug_link for task in bug_tasks)
+        all_links = set(task.bug_link for task in get_all_lp_project_bug_tasks(
+            lp, opts.sync_project_bugs, opts.days, None, modified_since))
+        plan['filtered'] = [
+            {'bug': bug_link_id(link)} for link in sorted(all_links - wanted)]
+
+    if db:
+        plan['watermark'] = {
+            'scope': sync_scope(opts),
+            'since': sync_started.isoformat()}
+
+    plan['api_calls'] = plan_api_calls(plan)
+
+    return plan, bugs
+
+
+def plan_api_calls(plan):
+    """Estimate how many requests applying plan will send to each service"""
+
+    created = len(plan['create'])
+    batches = -(-created // jira_bulk_size)
+    options = plan['options']
+
+    # One project lookup and one bulk create per batch, a remote link for
+    # each issue and the epic once per batch
+    jira_calls = 2 * batches + created
+    if options['epic']:
+        jira_calls += batches
+
+    # The bug is loaded then saved once with all the changes
+    lp_calls = 0
+    if options['lp_link'] or not options['no_lp_tag']:
+        lp_calls = 2 * created
+
+    return {'jira': jira_calls, 'launchpad': lp_calls}
+
+
+def apply_plan(lp, jira, plan, opts, db=None, bugs=None):
+    """
+    Create the JIRA issues of a plan from plan_project_sync and update the
+    Launchpad bugs accordingly. bugs can provide the bugs already loaded.
+    The bugs db already maps to an issue are skipped, applying the plan
+    again after a partial failure only creates the missing issues.
+    Return the number of bugs that failed
+    """
+
+    bugs = bugs or {}
+    plan_opts = argparse.Namespace(**plan['options'])
+    project_id = plan['project']
+    failed = len(plan['failed'])
+
+    # Launchpad is updated in the background while issues get created, the
+    # bugs are loaded there through a session of that thread
+    writeback = lp_writeback_queue(partial(thread_lp, opts.max_per_host))
+
+    pending = [
+        (bugs.get(entry['bug']) or planned_bug(
+            entry['bug'], entry['web_link'], entry['bug_link']),
+         entry['issue'])
+        for entry in plan['create']]
+
+    # Create the new issues in batches rather than one by one
+    for start in range(0, len(pending), jira_bulk_size):
+        batch = pending[start:start + jira_bulk_size]
+        if db:
+            imported = db.index(project_id)
+            for bug, _ in batch:
+                if bug.id in imported:
+                    print("Launchpad bug {} already has the JIRA issue {}"
+                          .format(bug.id, imported[bug.id]))
+            batch = [entry for entry in batch if entry[0].id not in imported]
+            if not batch:
+                continue
+
+        for bug, jira_issue, error in create_jira_issues(
+                jira,
+                batch,
+                plan_opts,
+                opts.max_per_host):
+            if error:
+                failed += 1
+                print("Failed to create the JIRA issue of "
+                      "Launchpad bug {}: {}".format(bug.id, error))
+                continue
+
+            if db:
+                # Summary and status come with the next refresh
+                db.add_issue(project_id, bug.id, jira_issue.key)
+
+            update_lp_bug(bug, jira_issue, plan_opts, writeback)
+
+    for bug_id, error in writeback.close().items():
+        failed += 1
+        print("Couldn't add the JIRA reference to Launchpad bug {}: {}"
+              .format(bug_id, error))
+
+    # Next incremental run can start from here, failed bugs get another
+    # chance as the watermark didn't move
+    if db and plan['watermark'] and not failed:
+        db.set_watermark(
+            plan['watermark']['scope'],
+            datetime.fromisoformat(plan['watermark']['since']))
+
+    return failed
+
 
 def main(args=None):
     opt_parser = argparse.ArgumentParser(
@@ -209,6 +582,10 @@ def main(args=None):
             lp-to-jira -s ubuntu -t go-to-jira PR
             lp-to-jira -s ubuntu -t go-to-jira -t also-to-jira PR
             lp-to-jira -s ubuntu -t=-ignore-these PR
+            lp-to-jira -s ubuntu -j 8 PR
+            lp-to-jira -s ubuntu -i -t go-to-jira PR
+            lp-to-jira -s ubuntu --plan plan.json PR
+            lp-to-jira --apply plan.json PR
         ''')
     )
     opt_parser.add_argument(
@@ -263,6 +640,28 @@ def main(args=None):
         type=int,
         help='Only look for LP Bugs in the past n days'
     )
+    opt_parser.add_argument(
+        '-i', '--incremental',
+        dest='incremental',
+        action='store_true',
+        help=textwrap.dedent('''
+            Only look for LP Bugs changed since the last successful
+            --sync_project_bugs run with the same project, tags and days
+            ''')
+    )
+    opt_parser.add_argument(
+        '--plan',
+        dest='plan',
+        help=textwrap.dedent('''
+            With --sync_project_bugs, save what would be done into the
+            json file PLAN instead of doing it
+            ''')
+    )
+    opt_parser.add_argument(
+        '--apply',
+        dest='apply',
+        help='Import the bugs listed in a json file saved with --plan'
+    )
     opt_parser.add_argument(
         '-t', '--tag',
         dest='tags',
@@ -273,6 +672,37 @@ def main(args=None):
             prepend a '-', e.g. '-unwantedtag'
             ''')
     )
+    opt_parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs',
+        action='store',
+        type=int,
+        default=1,
+        help='Import up to JOBS bugs at once with --sync_project_bugs'
+    )
+    opt_parser.add_argument(
+        '--max-per-host',
+        dest='max_per_host',
+        action='store',
+        type=int,
+        default=4,
+        help=textwrap.dedent('''
+            Maximum number of concurrent requests sent to Launchpad or
+            JIRA when running with --jobs (default 4)
+            ''')
+    )
+    opt_parser.add_argument(
+        '--db',
+        dest='db',
+        help='Keep the LP/JIRA mapping in the database FILE '
+             '(default {})'.format(default_db_path())
+    )
+    opt_parser.add_argument(
+        '--no-db',
+        dest='no_db',
+        action='store_true',
+        help='Search JIRA for imported bugs instead of using the database'
+    )
     opt_parser.add_argument(
         '--add-link-in-lp-desc',
         dest='lp_link',
@@ -288,43 +718,67 @@ def main(args=None):
 
     opts = opt_parser.parse_args(args)
 
-    if (opts.bug == 0 and not opts.sync_project_bugs):
+    if opts.plan and not opts.sync_project_bugs:
+        opt_parser.print_usage()
+        print('lp-to-jira: error: --plan requires --sync_project_bugs')
+        return 1
+
+    if (opts.bug == 0 and not opts.sync_project_bugs and not opts.apply):
         opt_parser.print_usage()
         print('lp-to-jira: error: the follow argument is required: bug')
         return 1
 
-    # Connect to Launchpad API
-    # TODO: catch exception if the Launchpad API isn't open
-    snap_home = os.getenv("SNAP_USER_COMMON")
-    if snap_home:
-        credential_store = UnencryptedFileCredentialStore(
-            "{}/.lp_creds".format(snap_home))
-    else:
-        credential_store = UnencryptedFileCredentialStore(
-            os.path.expanduser("~/.lp_creds"))
-    lp = Launchpad.login_with(
-        'foundations',
-        'production',
-        version='devel', credential_store=credential_store)
-
-    # Connect to the JIRA API
+    if opts.incremental and (opts.no_db or not opts.sync_project_bugs):
+        opt_parser.print_usage()
+        print('lp-to-jira: error: --incremental requires '
+              '--sync_project_bugs and the database')
+        return 1
+
+    # Only connect to Launchpad and JIRA once they are actually needed
+    lp = lazy_api(lp_login)
+    jira = lazy_api(jira_connect)
+
+    db = None if opts.no_db else lp_jira_db(opts.db)
+
     try:
-        api = jira_api()
-    except ValueError:
+        return lp_to_jira_main(opts, lp, jira, db)
+    except jira_init_error:
         return "ERROR: Cannot initialize JIRA API."
 
-    jira = JIRA(api.server, basic_auth=(api.login, api.token))
+
+def lp_to_jira_main(opts, lp, jira, db=None):
+    """Do what the command line options opts ask for"""
+
+    if opts.apply:
+        with open(opts.apply) as fp:
+            plan = json.load(fp)
+        if plan['project'] != opts.project:
+            print("lp-to-jira: error: {} is a plan for project {}".format(
+                opts.apply, plan['project']))
+            return 1
+        return 1 if apply_plan(lp, jira, plan, opts, db) else 0
 
     if opts.sync_project_bugs:
-        tasks_list = get_all_lp_project_bug_tasks(
-            lp, opts.sync_project_bugs, opts.days, opts.tags)
-        if tasks_list is None:
+        plan, bugs = plan_project_sync(
+            lp, jira, opts, db, filtered=bool(opts.plan))
+        if plan is None:
             return 1
 
-        for bug_task in tasks_list:
-            bug = bug_task.bug
-            lp_to_jira_bug(lp, jira, bug, opts.project, opts)
-        return 0
+        if opts.plan:
+            with open(opts.plan, 'w') as fp:
+                json.dump(plan, fp, indent=2)
+            print("Plan saved as {}: {} to create, {} already in JIRA, "
+                  "{} filtered by tag, {} failed".format(
+                      opts.plan,
+                      len(plan['create']),
+                      len(plan['skip']),
+                      len(plan['filtered']),
+                      len(plan['failed'])))
+            print("Expected API calls: {} JIRA, {} Launchpad".format(
+                plan['api_calls']['jira'], plan['api_calls']['launchpad']))
+            return 0
+
+        return 1 if apply_plan(lp, jira, plan, opts, db, bugs) else 0
 
     bug_number = opts.bug
     project_id = opts.project
@@ -333,15 +787,24 @@ def main(args=None):
     if bug is None:
         return 1
 
+    # Only rely on the database once it knows about the whole project, a
+    # single bug isn't worth fetching all of it again
+    index = None
+    if db and db.refreshed(project_id):
+        index = get_jira_bug_index(jira, project_id, db, incremental=True)
+
     if opts.exists:
         # We are simply testing if the bug was already in JIRA
-        if is_bug_in_jira(jira, bug, project_id):
+        if is_bug_in_jira(jira, bug, project_id, index):
             return 0
         print("Launchpad Issue {} is not in JIRA project {}".format(
             bug.id, project_id))
         return 1
 
     # Create the Jira Issue
-    lp_to_jira_bug(lp, jira, bug, project_id, opts)
+    jira_issue = lp_to_jira_bug(lp, jira, bug, project_id, opts, index)
+
+    if db and jira_issue:
+        db.add_issue(project_id, bug.id, jira_issue.key)
 
     return 0
@@ -3,19 +3,31 @@
 # create a new Entry in JIRA in a given project
 
 
-import os
+import sys
 import json
+import sqlite3
 import datetime
 
 import argparse
 import textwrap
 
-from launchpadlib.launchpad import Launchpad
-from launchpadlib.credentials import UnencryptedFileCredentialStore
-
-from jira import JIRA
-from LpToJira.jira_api import jira_api
-from LpToJira.lp_bug import lp_bug, ubuntu_devel
+from collections.abc import MutableMapping
+from functools import partial
+
+from LpToJira.jira_api import \
+    jira_connect, jira_issue_cache, lazy_api, search_all_issues, \
+    stored_issue
+from LpToJira.jira_writeback import \
+    describe_error, jira_comment, jira_transition, jira_update, \
+    jira_write_queue, run_actions
+from LpToJira.launchpad_api import lp_login, thread_lp
+from LpToJira.lp_bug import \
+    all_task_statuses, bug_link_id, lp_bugs, ubuntu_devel, ubuntu_version
+from LpToJira.lp_bug_store import lp_bug_store
+from LpToJira.lp_snapshot import load_bug_snapshot, snapshot_requests
+from LpToJira.workers import run_ordered
+from LpToJira.lp_jira_db import \
+    active_statuses, default_db_path, get_bug_id, lp_jira_db
 
 jira_server = ""
 jira_project = ""
@@ -25,23 +37,21 @@ jira_lp_db = []
 jira = None
 api = None
 
-series = ["Devel",
-          "Jammy",
-          "Impish",
-          "Hirsute",
-          "Focal",
-          "Bionic",
-          "Xenial",
-          "Trusty"]
-
-colummns = ["Jira ID",
-            "Summary",
-            "Status",
-            "LaunchPad ID",
+# One status column per Ubuntu serie, the development one being Devel
+series = ["Devel"] + [
+    serie for serie in ubuntu_version if serie != ubuntu_devel]
+
+# JIRA fields the report and the sync read from the issues
+report_jira_fields = ["summary", "status", "labels"]
+
+# Columns of a report entry read from JIRA, the others come from Launchpad
+jira_columns = ["JIRA ID", "Summary", "Status", "LaunchPad ID"]
+
+colummns = jira_columns + [
             "Heat",
             "Importance",
             "Packages",
-            ] + series
+            ] + series + ["LP Updated"]
 
 importance_color = {
     "Critical": 'style="color:#d12b1f"',
@@ -63,123 +73,163 @@ status_color = {
 }
 
 
-def status_cell(status):
-    return "<td %s>%s</td>" % (status_color.get(status, ""), status)
+# Importance of a bug from least to most important, to sort them
+importance_rank = {
+    importance: rank
+    for rank, importance in enumerate(reversed(list(importance_color)))}
+
+
+def script_json(value):
+    """JSON of value safe to put in a <script> element"""
+    return json.dumps(value).replace("</", "<\\/")
 
 
 def java_script():
-    'Sort a table https://www.w3schools.com/howto/howto_js_sort_table.asp'
-    'Addition of numeric boolean to allow sorting based on numbers'
+    """
+    Render the rows of the report in a virtualized table: only the rows
+    in view are in the page. Sorting goes through keys computed once per
+    column (numbers for the heat, a rank for the importance) and the search
+    goes through a lowercase index of the rows once typing pauses
+    """
     script = """\
     <script>
-    function search() {
-        // Declare variables
-        var input, filter, table, lines, line, value, show, i, txtValue;
-        input = document.getElementById("myInput");
-        filter = input.value.toUpperCase();
-        table = document.getElementById("JIRA-LP-TABLE");
-        lines = table.getElementsByTagName("TR");
-
-        // Loop through all table rows, and hide those who don't match
-        // the search query
-        for (i = 1; i < lines.length; i++) {
-            line = lines[i].getElementsByTagName("TD");
-            show = false;
-            for (j = 0; j < line.length; j++) {
-                value = line[j];
-                if (value) {
-                    txtValue = value.textContent || value.innerText;
-                    if (txtValue.toUpperCase().indexOf(filter) > -1) {
-                        show = true;
-                        break;
-                    }
-                }
-            }
-            if(show)
-                lines[i].style.display = "";
-            else
-                lines[i].style.display = "none";
+    var rowHeight = 28;
+    var numericColumns = {"Heat": true, "LaunchPad ID": true};
+    var keys = [], index = [], order = [], view = [];
+    var sortColumn = -1, sortDir = 1, searchTimer = null, rendering = false;
+
+    function escapeHtml(value) {
+        return String(value).replace(/[&<>"']/g, function (c) {
+            return {"&": "&amp;", "<": "&lt;", ">": "&gt;",
+                    '"': "&quot;", "'": "&#39;"}[c];
+        });
+    }
+
+    function sortKey(column, value) {
+        if (numericColumns[column]) {
+            var number = parseFloat(value);
+            return isNaN(number) ? -Infinity : number;
         }
+        if (column == "Importance")
+            return value in importanceRank ? importanceRank[value] : -1;
+        return value.toLowerCase();
     }
 
-    function sortTable(n,numerical) {
-        var table, rows, switching, i, x, y, shouldSwitch, dir, switchcount=0;
-        table = document.getElementById("JIRA-LP-TABLE");
-        switching = true;
-        // Set the sorting direction to ascending:
-        dir = "asc";
-        /* Make a loop that will continue until
-        no switching has been done: */
-        while (switching) {
-        // Start by saying: no switching is done:
-        switching = false;
-        rows = table.rows;
-        /* Loop through all table rows (except the
-        first, which contains table headers): */
-        for (i = 1; i < (rows.length - 1); i++) {
-            // Start by saying there should be no switching:
-            shouldSwitch = false;
-            /* Get the two elements you want to compare,
-            one from current row and one from the next: */
-            x = rows[i].getElementsByTagName("TD")[n];
-            y = rows[i + 1].getElementsByTagName("TD")[n];
-            /* Check if the two rows should switch place,
-            based on the direction, asc or desc: */
-            if (dir == "asc") {
-            if (numerical) {
-                //check if the two rows should switch place:
-                if (Number(x.innerHTML) < Number(y.innerHTML)) {
-                    //if so, mark as a switch and break the loop:
-                    shouldSwitch = true;
-                    break;
-                }
-            }
-            else if (x.innerHTML.toLowerCase() > y.innerHTML.toLowerCase()) {
-                // If so, mark as a switch and break the loop:
-                shouldSwitch = true;
-                break;
-            }
-            } else if (dir == "desc") {
-            if (numerical) {
-                //check if the two rows should switch place:
-                if (Number(x.innerHTML) > Number(y.innerHTML)) {
-                    //if so, mark as a switch and break the loop:
-                    shouldSwitch = true;
-                    break;
-                }
-            }
-            else if (x.innerHTML.toLowerCase() < y.innerHTML.toLowerCase()) {
-                // If so, mark as a switch and break the loop:
-                shouldSwitch = true;
-                break;
-            }
-            }
+    function prepare() {
+        keys = columns.map(function (column, n) {
+            return rows.map(function (row) { return sortKey(column, row[n]); });
+        });
+        index = rows.map(function (row) {
+            return row.join("\\n").toLowerCase();
+        });
+        order = rows.map(function (row, i) { return i; });
+        view = order;
+    }
+
+    function renderCell(column, value) {
+        var text = escapeHtml(value);
+        switch (column) {
+        case "JIRA ID":
+            return '<td><a href="' + escapeHtml(jiraServer) + '/browse/' +
+                text + '">' + text + '</a></td>';
+        case "Summary":
+            return "<td>" + escapeHtml(
+                value.length > 80 ? value.substr(0, 80) + " ..." : value) +
+                "</td>";
+        case "LaunchPad ID":
+            return '<td><a href="https://pad.lv/' + text + '">LP#' + text +
+                "</a></td>";
+        case "Importance":
+            return "<td " + (importanceColors[value] || "") + "><b>" +
+                text + "</b></td>";
+        case "Packages":
+            return "<td>" + (value.split(",").length > 2 ?
+                "multiple packages" : text) + "</td>";
         }
-        if (shouldSwitch) {
-            /* If a switch has been marked, make the switch
-            and mark that a switch has been done: */
-            rows[i].parentNode.insertBefore(rows[i + 1], rows[i]);
-            switching = true;
-            // Each time a switch is done, increase this count by 1:
-            switchcount ++;
-        } else {
-            /* If no switching has been done AND the direction is "asc",
-            set the direction to "desc" and run the while loop again. */
-            if (switchcount == 0 && dir == "asc") {
-            dir = "desc";
-            switching = true;
-            }
+        if (statusColumns.indexOf(column) > -1)
+            return "<td " + (statusColors[value] || "") + ">" + text + "</td>";
+        return "<td>" + text + "</td>";
+    }
+
+    function renderRow(row) {
+        var cells = [];
+        for (var n = 0; n < columns.length; n++)
+            cells.push(renderCell(columns[n], row[n]));
+        return "<tr>" + cells.join("") + "</tr>";
+    }
+
+    function render() {
+        var container = document.getElementById("JIRA-LP-VIEW");
+        var body = document.getElementById("JIRA-LP-BODY");
+        var first = Math.max(
+            0, Math.floor(container.scrollTop / rowHeight) - 10);
+        var last = Math.min(
+            view.length,
+            first + Math.ceil(container.clientHeight / rowHeight) + 20);
+        var html = ['<tr style="height:' + first * rowHeight + 'px"></tr>'];
+
+        for (var i = first; i < last; i++)
+            html.push(renderRow(rows[view[i]]));
+        html.push('<tr style="height:' + (view.length - last) * rowHeight +
+                  'px"></tr>');
+        body.innerHTML = html.join("");
+
+        // Use the real height of the rows once some are displayed
+        if (last > first && body.rows[1].offsetHeight != rowHeight) {
+            rowHeight = body.rows[1].offsetHeight;
+            render();
         }
+    }
+
+    function filter() {
+        var query = document.getElementById("myInput").value.toLowerCase();
+        view = !query ? order : order.filter(function (i) {
+            return index[i].indexOf(query) > -1;
+        });
+        document.getElementById("JIRA-LP-VIEW").scrollTop = 0;
+        render();
+    }
+
+    function search() {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(filter, 200);
+    }
+
+    function sortTable(n) {
+        var column = keys[n];
+        if (sortColumn == n) {
+            sortDir = -sortDir;
+        } else {
+            sortColumn = n;
+            // Hottest and most important bugs first
+            sortDir = typeof column[0] == "number" ? -1 : 1;
         }
+        order.sort(function (a, b) {
+            var x = column[a], y = column[b];
+            return x < y ? -sortDir : x > y ? sortDir : a - b;
+        });
+        filter();
     }
+
+    document.getElementById("JIRA-LP-VIEW").addEventListener(
+        "scroll", function () {
+            if (!rendering) {
+                rendering = true;
+                window.requestAnimationFrame(function () {
+                    rendering = false;
+                    render();
+                });
+            }
+        });
+    prepare();
+    render();
     </script>
     """
 
     return script
 
 
-def print_html_report(db, file):
-    html_data = """\
+html_head = """\
     <!DOCTYPE html>
     <html><title>Foundations JIRA / Launchpad status</title>
     <head>
@@ -212,62 +262,230 @@ def print_html_report(db, file):
         border: 1px solid black;
         }
 
+        #JIRA-LP-VIEW {
+        height: 85vh; /* Only the rows in view are rendered */
+        overflow-y: auto;
+        }
+
+        #JIRA-LP-TABLE {
+        border-collapse: collapse;
+        }
+
+        #JIRA-LP-TABLE td {
+        white-space: nowrap; /* Keep all the rows the same height */
+        }
+
+        #JIRA-LP-TABLE th {
+        position: sticky;
+        top: 0;
+        background-color: #f1f1f1;
+        cursor: pointer;
+        }
+
     </style>
     </head>
     """
-    html_data += java_script()
 
-    html_data += "<body>\n"
 
-    html_data += "<p>Report generated on {}</p>\n" \
-        .format(datetime.datetime.now())
-    html_data += '<input type="text" id="myInput" onkeyup="search()" '\
-                 'placeholder="Search ..">'
-    html_data += '<table id="JIRA-LP-TABLE">\n'
+def html_header_row(columns):
+    line = ["<tr>\n"]
+    for index, header in enumerate(columns):
+        line.append('<th onclick="sortTable(%d)">%s</th>\n' %
+                    (index, header))
+    line.append("</tr>\n")
+    return "".join(line)
+
+
+class report_writer():
+    """
+    Write report entries to a file one at a time as they come, each entry
+    is flushed so the file fills up while the report is still running.
+    The writers --previous can read add the datetime generated to each
+    entry if provided, so that it knows since when its data may have
+    changed
+    """
+    def __init__(self, file, generated=None):
+        self.file = file
+        self.generated = generated
+        self.output = open(file, 'w')
+        self.entries = 0
+
+    def write(self, entry):
+        self.write_entry(entry)
+        self.entries += 1
+        self.output.flush()
+
+    def write_entry(self, entry):
+        raise NotImplementedError
+
+    def row(self, entry):
+        """entry as a dict, with the time the report was generated"""
+        row = dict(entry)
+        if self.generated is not None:
+            row['Generated'] = self.generated.isoformat()
+        return row
+
+    def close(self):
+        self.output.close()
 
-    title = True
+
+class csv_report(report_writer):
+    def write_entry(self, entry):
+        if not self.entries:
+            self.output.write(";".join(entry.keys()) + "\n")
+        self.output.write(";".join(entry.values()) + "\n")
+
+
+class json_report(report_writer):
+    """Stream the entries as the same JSON list json.dump(indent=2) gives"""
+    def write_entry(self, entry):
+        self.output.write("[\n" if not self.entries else ",\n")
+        self.output.write(
+            textwrap.indent(json.dumps(self.row(entry), indent=2), "  "))
+
+    def close(self):
+        self.output.write("\n]" if self.entries else "[]")
+        super().close()
+
+
+class jsonl_report(report_writer):
+    """Write one JSON object per line, to be read or tailed line by line"""
+    def write_entry(self, entry):
+        self.output.write(json.dumps(self.row(entry)) + "\n")
+
+
+class html_report(report_writer):
+    """
+    Write the entries as a list of rows in the page, java_script() takes
+    care of displaying them
+    """
+    def start(self, columns):
+        self.output.write(html_head)
+        self.output.write("<body>\n")
+        self.output.write("<p>Report generated on {}</p>\n"
+                          .format(datetime.datetime.now()))
+        self.output.write('<input type="text" id="myInput" '
+                          'oninput="search()" placeholder="Search ..">')
+        self.output.write('<div id="JIRA-LP-VIEW">\n')
+        self.output.write('<table id="JIRA-LP-TABLE">\n')
+        self.output.write("<thead>\n" + html_header_row(columns) +
+                          "</thead>\n")
+        self.output.write('<tbody id="JIRA-LP-BODY"></tbody>\n')
+        self.output.write("</table>\n</div>\n")
+
+        self.output.write("<script>\n")
+        for name, value in [
+                ("jiraServer", jira_server),
+                ("columns", columns),
+                ("statusColumns", series),
+                ("statusColors", status_color),
+                ("importanceColors", importance_color),
+                ("importanceRank", importance_rank)]:
+            self.output.write(
+                "var {} = {};\n".format(name, script_json(value)))
+        self.output.write("var rows = [\n")
+
+    def write_entry(self, entry):
+        if not self.entries:
+            self.start(list(entry.keys()))
+        self.output.write(script_json(list(entry.values())) + ",\n")
+
+    def close(self):
+        if not self.entries:
+            self.start(list(new_report_entry("", "", "", "").keys()))
+        self.output.write("];\n</script>\n")
+        self.output.write(java_script())
+        self.output.write("</body></html>")
+        super().close()
+
+
+class table_report():
+    """
+    Print the entries as an aligned table, the width of the columns
+    depends on every entry so this one keeps them until it is closed
+    """
+    def __init__(self, file="/dev/stdout"):
+        self.file = file
+        self.table = []
+
+    def write(self, entry):
+        if not self.table:
+            self.table.append(list(entry.keys()))
+        # The values of a report_row are already a list, no need to copy
+        values = entry.values()
+        self.table.append(
+            values if isinstance(values, list) else list(values))
+
+    def close(self):
+        print_table(self.table, sep=" | ", limit=60,
+                    align=True, draw_title=True, file=self.file)
+
+
+class sqlite_report():
+    """
+    Write the entries in the report table of the SQLite database file,
+    with one column per entry key (lowercase, spaces turned to
+    underscores) and indexed by JIRA ID and Launchpad ID. The table is
+    replaced on each run and committed every commit_every entries
+    """
+    integer_columns = ['LaunchPad ID', 'Heat']
+
+    def __init__(self, file, commit_every=100):
+        self.file = file
+        self.db = sqlite3.connect(str(file))
+        self.commit_every = commit_every
+        self.entries = 0
+
+    @staticmethod
+    def column_name(key):
+        return key.lower().replace(" ", "_")
+
+    def start(self, keys):
+        columns = []
+        for key in keys:
+            column = self.column_name(key)
+            if key == 'JIRA ID':
+                columns.append("{} TEXT PRIMARY KEY".format(column))
+            elif key in self.integer_columns:
+                columns.append("{} INTEGER".format(column))
+            else:
+                columns.append("{} TEXT".format(column))
+
+        lp_column = self.column_name('LaunchPad ID')
+        self.db.executescript("""
+            DROP TABLE IF EXISTS report;
+            CREATE TABLE report ({});
+            CREATE INDEX report_{} ON report ({});
+            """.format(", ".join(columns), lp_column, lp_column))
+
+        self.insert = "INSERT OR REPLACE INTO report VALUES ({})".format(
+            ", ".join("?" * len(keys)))
+
+    def write(self, entry):
+        if not self.entries:
+            self.start(list(entry.keys()))
+
+        self.db.execute(self.insert, [
+            (int(value) if value.isdigit() else None)
+            if key in self.integer_columns else value
+            for key, value in entry.items()])
+        self.entries += 1
+
+        if not self.entries % self.commit_every:
+            self.db.commit()
+
+    def close(self):
+        if not self.entries:
+            self.start(list(new_report_entry("", "", "", "").keys()))
+        self.db.commit()
+        self.db.close()
+
+
+def print_html_report(db, file):
+    report = html_report(file)
     for entry in db:
-        if title:
-            headers = entry.keys()
-            line = ""
-            line += "<tr>\n"
-            index = 0
-            for header in headers:
-                line += '<th onclick="sortTable(%d,false)">%s</th>\n' % \
-                    (index, header)
-                index += 1
-            line += "</tr>\n"
-            html_data += line
-            title = False
-
-        line = "<tr>\n"
-        line += "\t<td><a href=%s/browse/%s>%s</a></td>\n" % \
-            (jira_server, entry['JIRA ID'], entry['JIRA ID'])
-        line += "\t<td>%s</td>\n" % \
-            (entry['Summary'][:80]+" ..." if len(entry['Summary']) > 80
-                else entry['Summary'])
-        line += "\t<td>%s</td>\n" % entry['Status']
-
-        line += "\t<td><a href=https://pad.lv/%s>LP#%s</a></td>\n" % \
-            (entry['LaunchPad ID'], entry['LaunchPad ID'])
-        line += "\t<td>%s</td>\n" % entry['Heat']
-        line += "\t<td %s><b>%s</b></td>\n" % \
-            (importance_color.get(entry['Importance']), entry['Importance'])
-        line += "\t<td>%s</td>\n" % \
-            ("multiple packages" if len(entry['Packages'].split(",")) > 2
-                else entry['Packages'])
-
-        for serie in series:
-            line += ("\t" + status_cell(entry[serie]) + "\n")
-
-        line += "</tr>\n"
-        html_data += line + "\n"
-
-    html_data += "</table>"
-    html_data += "</body></html>"
-
-    with open(file, 'w') as html_file:
-        html_file.write(html_data)
+        report.write(entry)
+    report.close()
 
 
 def print_table(
@@ -314,81 +532,116 @@ def print_table(
                 draw_title = False
 
 
-def get_bug_id(summary):
-    "Extract the bug id from a jira title whivh would icnlude LP#"
-    id = ""
+class report_row(MutableMapping):
+    """
+    A report entry: a mapping of the colummns to their value, all strings.
+    The values are kept in a list rather than a dict and the statuses,
+    importances and package names are interned, as a report can have a
+    lot of those
+    """
+    __slots__ = ['cells']
 
-    if "LP#" in summary:
-        for char in summary[summary.find("LP#")+3:]:
-            if char.isdigit():
-                id = id + char
-            else:
-                break
+    columns = colummns
+    index = {column: n for n, column in enumerate(colummns)}
+
+    def __init__(self, cells=None):
+        self.cells = list(cells) if cells else [''] * len(self.columns)
+
+    def __getitem__(self, column):
+        return self.cells[self.index[column]]
+
+    def __setitem__(self, column, value):
+        self.cells[self.index[column]] = value
+
+    def __delitem__(self, column):
+        raise TypeError("Report columns can't be removed")
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def values(self):
+        """The values in column order, that list isn't a copy"""
+        return self.cells
 
-    return id
+    def __repr__(self):
+        return "report_row({})".format(dict(self))
 
 
-def find_issues_in_project(api, project):
+def new_report_entry(jira_key, summary, status, lpbug_id):
+    entry = report_row()
+    entry['JIRA ID'] = jira_key
+    entry['Summary'] = summary
+    entry['Status'] = sys.intern(status)
+    entry['LaunchPad ID'] = lpbug_id
+    return entry
+
+
+def iter_issues_in_project(api, project, db=None, cache=None):
+    """
+    Generator of a report entry for every active issue of project imported
+    from Launchpad, following the JIRA search pages. When db (see
+    lp_jira_db) is provided it is refreshed with what changed in JIRA and
+    the entries are read from it.
+    The issues the search returns, or the ones db knows the labels of, are
+    added to cache (see jira_issue_cache)
+    """
     if not api or not project:
-        return []
+        return
+
+    if db:
+        db.refresh(api, project)
+        for row in db.issues(project, active_statuses):
+            if cache is not None and row['labels'] is not None:
+                cache.add(stored_issue(
+                    api, row['jira_key'], row['summary'],
+                    row['jira_status'], row['labels'].split()))
+            yield new_report_entry(
+                row['jira_key'],
+                row['summary'],
+                row['jira_status'],
+                str(row['bug_id']))
+        return
+
+    request = "project = {} " \
+        "AND summary ~ \"LP#\" " \
+        "AND status in (BLOCKED, Backlog, \"In Progress\", " \
+        "REVIEW,\"Selected for Development\")""".format(project)
+
+    # For each issue in JIRA with LP# in the title, only asking for the
+    # fields the report uses
+    for issue in search_all_issues(
+            api, request, fields=report_jira_fields):
+        summary = issue.fields.summary
+        if "LP#" not in summary:
+            continue
+
+        if cache is not None:
+            cache.add(issue)
+
+        lpbug_id = get_bug_id(summary)
+        yield new_report_entry(
+            issue.key, summary, issue.fields.status.name, lpbug_id)
 
-    # Get JIRA issues in batch of 50
-    issue_index = 0
-    issue_batch = 50
-
-    found_issues = []
-
-    while True:
-        start_index = issue_index * issue_batch
-        request = "project = {} " \
-            "AND summary ~ \"LP#\" " \
-            "AND status in (BLOCKED, Backlog, \"In Progress\", " \
-            "REVIEW,\"Selected for Development\")""".format(project)
-        issues = api.search_issues(request, startAt=start_index)
-
-        if not issues:
-            break
-
-        issue_index += 1
-
-        # For each issue in JIRA with LP# in the title
-        for issue in issues:
-            summary = issue.fields.summary
-            if "LP#" not in summary:
-                continue
-
-            lpbug_id = get_bug_id(summary)
-            entry = {
-                'JIRA ID': issue.key,
-                'Summary': summary,
-                'Status': issue.fields.status.name,
-                'LaunchPad ID': lpbug_id,
-                'Heat': '',
-                'Importance': '',
-                'Packages': '',
-                "Devel": '',
-                "Jammy": '',
-                "Impish": '',
-                "Hirsute": '',
-                "Focal": '',
-                "Bionic": '',
-                "Xenial": '',
-                "Trusty": ''
-            }
-            found_issues.append(entry)
 
-    return found_issues
+def find_issues_in_project(api, project, db=None):
+    """Return the list of entries iter_issues_in_project goes through"""
+    return list(iter_issues_in_project(api, project, db))
 
 
-def sync_title(issue, jira, lp):
+def sync_title(issue, jira, lp, cache=None, writes=None):
     if not issue or not jira or not lp:
         return False
 
     jira_key = issue['JIRA ID']
     lp_id = issue['LaunchPad ID']
-    lp_summary = lp.bugs[int(lp_id)].title
+    lp_summary = lp_bugs.get(lp_id, lp).title
 
-    jira_issue = jira.issue(issue["JIRA ID"])
+    if cache is None:
+        cache = jira_issue_cache(jira)
+    jira_issue = cache.get(jira_key)
 
     # TODO: smarter formatting with regexp or something
     summary = issue['Summary']
@@ -401,11 +654,13 @@ def sync_title(issue, jira, lp):
                   .format(jira_key, new_summary))
 
             issue['Summary'] = new_summary
-            jira.add_comment(
-                jira_issue,
-                ('{{jira-bot}} Fixed out of sync title with LP: #%s') % (lp_id)
-                )
-            jira_issue.update(summary=new_summary)
+            run_actions(jira, [
+                jira_comment(
+                    jira_issue,
+                    ('{{jira-bot}} Fixed out of sync title with LP: #%s')
+                    % (lp_id)),
+                jira_update(jira_issue, summary=new_summary)
+                ], writes)
 
             return True
     else:
@@ -415,14 +670,16 @@ def sync_title(issue, jira, lp):
     return False
 
 
-def sync_release(issue, jira, lp):
+def sync_release(issue, jira, lp, cache=None, writes=None):
     if not issue or not jira:
         return False
 
     jira_key = issue['JIRA ID']
     lp_id = issue['LaunchPad ID']
 
-    jira_issue = jira.issue(issue["JIRA ID"])
+    if cache is None:
+        cache = jira_issue_cache(jira)
+    jira_issue = cache.get(jira_key)
 
     # automation 1: check for release status over all series and move the
     # to Done if they are all Fix Released or Won't Fix
@@ -433,7 +690,7 @@ def sync_release(issue, jira, lp):
         # To the LP bug and go through all the affected packages
         # and if for all the packages and all the series it is either Fix
         # Released or Won't Fix, Well then it is DONE in JIRA
-        bug = lp_bug(lp_id, lp)
+        bug = lp_bugs.get(lp_id, lp)
         for pkg in bug.affected_packages:
             for serie in bug.affected_series(pkg):
                 if bug.package_detail(
@@ -457,8 +714,16 @@ def sync_release(issue, jira, lp):
                            'moving this issue to '
                            '{color:#36B37E}*DONE*{color}') % (lp_id)
 
-            jira.add_comment(jira_issue, comment)
-            jira.transition_issue(jira_issue, transition='Done')
+            run_actions(jira, [
+                jira_comment(jira_issue, comment),
+                jira_transition(jira_issue, 'Done')
+                ], writes)
+            if writes:
+                # Queued, the transition may still fail
+                return False
+
+            # Keep the cached issue current without fetching it again
+            jira_issue.fields.status.name = 'Done'
             return True
 
     except Exception:
@@ -467,89 +732,276 @@ def sync_release(issue, jira, lp):
     return False
 
 
-def merge_lp_data_with_jira_issues(jira, lp, issues, sync=False):
-    if not lp or not jira or not issues:
-        return []
+class lp_row_counter():
+    """Count the report entries filled from Launchpad or a previous report"""
 
-    for issue in list(issues):
-        print("#", flush=True, end='')
-        lpbug_importance = ""
-        lpbug_devel = ""
-        lpbug_jammy = ""
-        lpbug_impish = ""
-        lpbug_hirsute = ""
-        lpbug_focal = ""
-        lpbug_bionic = ""
-        lpbug_xenial = ""
-        lpbug_trusty = ""
+    def __init__(self):
+        self.reused = 0
+        self.refreshed = 0
+
+    def __str__(self):
+        return "{} entries reused from the previous report, {} refreshed " \
+            "from Launchpad".format(self.reused, self.refreshed)
+
+
+row_stats = lp_row_counter()
 
+
+# How old a previous report can be to reuse its entries
+max_reuse_age = datetime.timedelta(days=7)
+
+
+def load_previous_report(file):
+    """
+    Return the entries of a report saved with --json or --jsonl by their
+    Launchpad ID, leaving out the ones without Launchpad data, and when
+    the report was generated, None if some entries don't tell
+    """
+    with open(file) as report:
         try:
-            lpbug = lp_bug(issue['LaunchPad ID'], lp)
-            # We will focus on the first package in the list of affected
-            # packages, not ideal but not sure there's a better way
-            # Maybe we should just ignore individual packages status...
+            entries = json.load(report)
+        except ValueError:
+            report.seek(0)
+            entries = [json.loads(line) for line in report if line.strip()]
+
+    generated = [entry.get('Generated') for entry in entries]
+    if generated and all(generated):
+        generated = min(map(datetime.datetime.fromisoformat, generated))
+    else:
+        generated = None
 
-            # setting default package to None in case bug is open against a
-            # project rather than agasint a package
-            pkg = "none"
+    return {
+        entry['LaunchPad ID']: entry
+        for entry in entries if entry.get('LP Updated')}, generated
 
-            if lpbug.affected_packages:
-                pkg = lpbug.affected_packages[0]
 
-                if lpbug.affected_series(pkg):
-                    lpbug_importance = lpbug.package_detail(
-                        pkg,
-                        lpbug.affected_series(pkg)[0],
-                        "importance")
-
-                    lpbug_devel = lpbug.package_detail(
-                        pkg, ubuntu_devel, "status")
-                    lpbug_jammy = lpbug.package_detail(
-                        pkg, "Jammy", "status")
-                    lpbug_impish = lpbug.package_detail(
-                        pkg, "Impish", "status")
-                    lpbug_hirsute = lpbug.package_detail(
-                        pkg, "Hirsute", "status")
-                    lpbug_focal = lpbug.package_detail(
-                        pkg, "Focal", "status")
-                    lpbug_bionic = lpbug.package_detail(
-                        pkg, "Bionic", "status")
-                    lpbug_xenial = lpbug.package_detail(
-                        pkg, "Xenial", "status")
-                    lpbug_trusty = lpbug.package_detail(
-                        pkg, "Trusty", "status")
-
-            issue['Heat'] = str(lpbug.heat)
-            issue['Importance'] = lpbug_importance
-            issue['Packages'] = pkg
-            issue["Devel"] = lpbug_devel
-            issue["Jammy"] = lpbug_jammy
-            issue["Impish"] = lpbug_impish
-            issue["Hirsute"] = lpbug_hirsute
-            issue["Focal"] = lpbug_focal
-            issue["Bionic"] = lpbug_bionic
-            issue["Xenial"] = lpbug_xenial
-            issue["Trusty"] = lpbug_trusty
-
-
-            if sync:
-                jira_key = issue["JIRA ID"]
-                jira_issue = jira.issue(jira_key)
-                if "DisableLPSync" in jira_issue.fields.labels:
-                    print("\n[Sync]- Disabled by user for {}".format(
-                        jira_key))
-                    continue
+def changed_bugs(lp, since):
+    """
+    Return the IDs of the bugs with an Ubuntu task changed since the
+    datetime since, with a single search going through all of Ubuntu
+    """
+    bug_tasks = lp.distributions['ubuntu'].searchTasks(
+        modified_since=since.isoformat(),
+        status=all_task_statuses,
+        omit_duplicates=False)
+
+    return {str(bug_link_id(task.bug_link)) for task in bug_tasks}
+
+
+def reusable_entries(lp, previous, since):
+    """
+    Return the entries of previous (see load_previous_report) whose bug
+    hasn't changed in Launchpad since the datetime since that report was
+    generated. Only the bugs of Ubuntu packages can be checked with
+    changed_bugs, the others are always refreshed. Nothing is reused from
+    a report older than max_reuse_age, going through every Ubuntu task
+    changed since then would take longer than refreshing the bugs, nor
+    from a report without its generation time
+    """
+    previous = {
+        lp_id: entry for lp_id, entry in previous.items()
+        if entry['Packages'] not in ["", "none"]}
+
+    if not previous:
+        return {}
+
+    if since is None:
+        print("The previous report doesn't tell when it was generated, "
+              "refreshing every bug")
+        return {}
+
+    if datetime.datetime.now(datetime.timezone.utc) - since > max_reuse_age:
+        print("The previous report is from {}, refreshing every bug".format(
+            since))
+        return {}
+
+    changed = changed_bugs(lp, since)
+
+    return {
+        lp_id: entry for lp_id, entry in previous.items()
+        if lp_id not in changed}
+
+
+def get_issue_lp_bug(issue, lp, jobs=1, reuse=None, store=None,
+                     offline=False):
+    """
+    Return the lp_bug of a report entry, when running with several jobs
+    the bug is loaded through a Launchpad session of the current thread.
+    None when the Launchpad data of the entry is in reuse. When offline
+    the bug is taken from store (see lp_bug_store) instead of Launchpad
+    """
+    if reuse and issue['LaunchPad ID'] in reuse:
+        return None
+
+    if offline:
+        return store.get(issue['LaunchPad ID'])
+
+    if jobs > 1:
+        lp = thread_lp()
+
+    return lp_bugs.get(
+        issue['LaunchPad ID'],
+        lp,
+        load_bug_snapshot(lp, issue['LaunchPad ID']))
+
+
+def fill_issue(issue, lpbug):
+    """Fill the Launchpad columns of a report entry from its lp_bug"""
+    lpbug_importance = ""
+    lpbug_series = dict.fromkeys(series, "")
+
+    # We will focus on the first package in the list of affected
+    # packages, not ideal but not sure there's a better way
+    # Maybe we should just ignore individual packages status...
+
+    # setting default package to None in case bug is open against a
+    # project rather than agasint a package
+    pkg = "none"
+
+    if lpbug.affected_packages:
+        pkg = lpbug.affected_packages[0]
+
+        if lpbug.affected_series(pkg):
+            lpbug_importance = lpbug.package_detail(
+                pkg,
+                lpbug.affected_series(pkg)[0],
+                "importance")
+
+            for serie in series:
+                lpbug_series[serie] = lpbug.package_detail(
+                    pkg,
+                    ubuntu_devel if serie == "Devel" else serie,
+                    "status")
+
+    issue['Heat'] = str(lpbug.heat)
+    issue['Importance'] = sys.intern(lpbug_importance)
+    issue['Packages'] = sys.intern(pkg)
+    for serie, status in lpbug_series.items():
+        issue[serie] = sys.intern(status)
+    issue["LP Updated"] = lpbug.date_last_updated.isoformat()
+
+
+def sync_issue(issue, jira, lp, cache, writes=None):
+    """
+    Sync the JIRA issue of a report entry with its Launchpad bug unless
+    the sync is disabled for it. Return True when it is moved to Done,
+    False when that is only queued in writes
+    """
+    jira_key = issue["JIRA ID"]
+    jira_issue = cache.get(jira_key)
+    if "DisableLPSync" in jira_issue.fields.labels:
+        print("\n[Sync]- Disabled by user for {}".format(jira_key))
+        return False
+
+    sync_title(issue, jira, lp, cache, writes)
+    return sync_release(issue, jira, lp, cache, writes)
+
+
+def iter_lp_data(
+        jira, lp, issues, sync=False, jobs=1, reuse=None, cache=None,
+        writes=None, store=None, offline=False):
+    """
+    Generator filling the report entries coming from issues with the data
+    of their Launchpad bug, fetching up to jobs bugs at once. Entries come
+    out in their original order, as soon as they are filled, and the JIRA
+    sync of each entry happens one at a time. Entries moved to Done by the
+    sync are left out, not the ones whose transition is only queued.
+    The Launchpad data of the entries in reuse (see reusable_entries) is
+    copied from there rather than fetched, the JIRA issues to sync are
+    taken from cache (see jira_issue_cache) and their changes queued in
+    writes (see jira_write_queue) if provided.
+    The bugs fetched are saved in store (see lp_bug_store) if provided, or
+    taken from there with offline
+    """
+    if not lp or not jira:
+        return
 
-                sync_title(issue, jira, lp)
-                if sync_release(issue, jira, lp):
-                    # Must remove the element as it is released
-                    issues.remove(issue)
+    if cache is None:
+        cache = jira_issue_cache(jira)
+
+    for issue, lpbug, error in run_ordered(
+            partial(get_issue_lp_bug, lp=lp, jobs=jobs, reuse=reuse,
+                    store=store, offline=offline),
+            issues,
+            jobs):
+        print("#", flush=True, end='')
+
+        try:
+            if error:
+                raise error
+
+            if lpbug is None:
+                previous = reuse[issue['LaunchPad ID']]
+                for column in issue:
+                    if column not in jira_columns:
+                        issue[column] = previous.get(column, '')
+                row_stats.reused += 1
+            else:
+                fill_issue(issue, lpbug)
+                row_stats.refreshed += 1
+                if store is not None and not offline:
+                    store.append(lpbug)
 
         except Exception:
-            print("\nCouldn't find the Launchpad bug {}".format(issue['LaunchPad ID']))
+            print("\nCouldn't find the Launchpad bug {}".format(
+                issue['LaunchPad ID']))
+            yield issue
+            continue
+
+        if sync:
+            try:
+                if sync_issue(issue, jira, lp, cache, writes):
+                    # The issue is released, it leaves the report
+                    continue
+            except Exception as err:
+                print("\n[Sync] - Couldn't sync {}: {}".format(
+                    issue["JIRA ID"], describe_error(err)))
+
+        yield issue
     print()
 
 
+def merge_lp_data_with_jira_issues(jira, lp, issues, sync=False, jobs=1):
+    """
+    Fill every report entry of issues with the data of its Launchpad bug,
+    see iter_lp_data, and remove the entries released by the sync
+    """
+    if not lp or not jira or not issues:
+        return []
+
+    issues[:] = iter_lp_data(jira, lp, list(issues), sync, jobs)
+
+
+def open_report_writers(opts, generated=None):
+    """
+    Return the (writer, message) pairs for the outputs opts asks for, the
+    entries of the reports --previous can read tell they were generated
+    at generated
+    """
+    writers = []
+    if opts.json:
+        writers.append(
+            (json_report(opts.json, generated),
+             "JSON report saved as %s" % opts.json))
+    if opts.html:
+        writers.append(
+            (html_report(opts.html), "HTML report saved as %s" % opts.html))
+    if opts.csv:
+        writers.append(
+            (csv_report(opts.csv), "CSV report saved as %s" % opts.csv))
+    if opts.jsonl:
+        writers.append(
+            (jsonl_report(opts.jsonl, generated),
+             "JSON Lines report saved as %s" % opts.jsonl))
+    if opts.sqlite:
+        writers.append(
+            (sqlite_report(opts.sqlite),
+             "SQLite report saved as %s" % opts.sqlite))
+    if not writers:
+        writers.append((table_report(), None))
+    return writers
+
+
 def main(args=None):
     global jira_server
 
@@ -563,6 +1015,12 @@ def main(args=None):
                 lp-to-jira-report --csv  results.csv  FR
                 lp-to-jira-report --json results.json FR
                 lp-to-jira-report --html results.html FR
+                lp-to-jira-report --jsonl results.jsonl FR
+                lp-to-jira-report --sqlite results.db FR
+                lp-to-jira-report --jobs 8 FR
+                lp-to-jira-report --json new.json --previous old.json FR
+                lp-to-jira-report --store bugs.snap FR
+                lp-to-jira-report --store bugs.snap --offline FR
             ''')
         )
     opt_parser.add_argument(
@@ -584,37 +1042,79 @@ def main(args=None):
         dest='json',
         help='export the results of the report into FILE in json format',
     )
+    opt_parser.add_argument(
+        '--jsonl',
+        dest='jsonl',
+        help='export the results of the report into FILE with one json '
+             'object per line',
+    )
+    opt_parser.add_argument(
+        '--sqlite',
+        dest='sqlite',
+        help='export the results of the report into the report table of '
+             'the sqlite database FILE',
+    )
+    opt_parser.add_argument(
+        '--previous',
+        dest='previous',
+        help='reuse the Launchpad data of the bugs unchanged since the '
+             'report FILE saved with --json or --jsonl, as long as it is '
+             'less than a week old',
+    )
+    opt_parser.add_argument(
+        '--store',
+        dest='store',
+        help='keep the Launchpad bugs of the report in the snapshot FILE',
+    )
+    opt_parser.add_argument(
+        '--offline',
+        dest='offline', action='store_true',
+        help='take the Launchpad bugs from the --store snapshot instead '
+             'of Launchpad',
+    )
     opt_parser.add_argument(
         '--sync',
         dest='sync', action='store_true',
         help='Sync JIRA items with corresponding bugs in LP',
     )
+    opt_parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=1,
+        help='Fetch up to JOBS Launchpad bugs at once',
+    )
+    opt_parser.add_argument(
+        '--db',
+        dest='db',
+        help='Keep the LP/JIRA mapping in the database FILE '
+             '(default {})'.format(default_db_path()),
+    )
+    opt_parser.add_argument(
+        '--no-db',
+        dest='no_db', action='store_true',
+        help='Search JIRA for all the issues instead of using the database',
+    )
 
     opts = opt_parser.parse_args(args)
 
+    if opts.offline and not opts.store:
+        opt_parser.error("--offline needs a snapshot from --store")
+    if opts.offline and (opts.sync or opts.previous):
+        opt_parser.error("--offline can't be used with --sync or --previous")
+
     jira_project = opts.project
 
     # 1. Initialize JIRA API
-    api = jira_api()
-    jira_server = api.server
-    jira = JIRA(api.server, basic_auth=(api.login, api.token))
-
-    # TODO: catch exception if the Launchpad API isn't open
-    # 2. Initialize Launchpad API
-    # Connect to Launchpad API
-    # TODO: catch exception if the Launchpad API isn't open
-    snap_home = os.getenv("SNAP_USER_COMMON")
-    if snap_home:
-        credential_store = UnencryptedFileCredentialStore(
-            "{}/.lp_creds".format(snap_home))
-    else:
-        credential_store = UnencryptedFileCredentialStore(
-            os.path.expanduser("~/.lp_creds"))
-    lp = Launchpad.login_with(
-        'foundations',
-        'production',
-        version='devel',
-        credential_store=credential_store)
+    jira = jira_connect()
+    jira_server = jira.client_info()
+
+    # 2. Initialize Launchpad API, only connected if there's a bug to look at
+    lp = lazy_api(lp_login)
+
+    db = None if opts.no_db else lp_jira_db(opts.db)
+
+    # Anything changed in Launchpad from now on may be missing from the
+    # report, --previous checks the bugs changed since then
+    started = datetime.datetime.now(datetime.timezone.utc)
 
     print(
         "Searching for JIRA issues in project %s imported with lp-to-jira..."
@@ -622,38 +1122,59 @@ def main(args=None):
         flush=True
         )
 
-    # Create a Database of all JIRA issues imported by lp-to-jira
-    jira_lp_db = find_issues_in_project(jira, jira_project)
-    print("Found %s issues" % len(jira_lp_db))
-
-    # For each issue retrieve latest lp data and sync if required
-    merge_lp_data_with_jira_issues(jira, lp, jira_lp_db, opts.sync)
-
-    # Create a table version of the database
-    jira_lp_db_table = []
-    if jira_lp_db:
-        jira_lp_db_table.append(list(jira_lp_db[0].keys()))
-        jira_lp_db_table += [list(x.values()) for x in jira_lp_db]
-    else:
+    reuse = None
+    if opts.previous:
+        try:
+            reuse = reusable_entries(
+                lp, *load_previous_report(opts.previous))
+        except (OSError, ValueError, KeyError) as err:
+            print("Couldn't use the previous report {}: {}".format(
+                opts.previous, err))
+
+    # Go through all JIRA issues imported by lp-to-jira, retrieve their
+    # latest lp data, sync them if required and hand them to the writers
+    # as they come
+    cache = jira_issue_cache(jira)
+    writes = jira_write_queue(jira, opts.jobs) if opts.sync else None
+    store = lp_bug_store(opts.store) if opts.store else None
+    entries = iter_lp_data(
+        jira, lp,
+        iter_issues_in_project(jira, jira_project, db, cache),
+        opts.sync, opts.jobs, reuse, cache, writes, store, opts.offline)
+
+    # The files are only created once there's something to report
+    writers = None
+    found = 0
+    for entry in entries:
+        if writers is None:
+            writers = open_report_writers(opts, started)
+        for writer, _ in writers:
+            writer.write(entry)
+        found += 1
+
+    if writes:
+        failed = writes.close()
+        if failed:
+            print("{} JIRA changes failed:".format(len(failed)))
+        for action, error in failed:
+            print(" - {}: {}".format(action, describe_error(error)))
+
+    if store is not None:
+        if store.needs_compaction:
+            store.compact()
+        store.close()
+
+    print("Found %s issues" % found)
+    print(row_stats)
+    print(snapshot_requests)
+    print(lp_bugs)
+
+    if writers is None:
         return 1
 
-    # Display the content of jira_lp_db based on the output option
-    if opts.json:
-        with open(opts.json, 'w') as fp:
-            json.dump(jira_lp_db, fp, indent=2)
-        print("JSON report saved as %s" % opts.json)
-
-    if opts.html:
-        print_html_report(jira_lp_db, opts.html)
-        print("HTML report saved as %s" % opts.html)
-
-    if opts.csv:
-        print_table(jira_lp_db_table, sep=";", limit=1024,
-                    align=False, draw_title=False, file=opts.csv)
-        print("CSV report saved as %s" % opts.csv)
-
-    if not opts.csv and not opts.html and not opts.json:
-        print_table(jira_lp_db_table, sep=" | ", limit=60,
-                    align=True, draw_title=True, file="/dev/stdout")
+    for writer, message in writers:
+        writer.close()
+        if message:
+            print(message)
 
     return 0
@@ -3,83 +3,225 @@
 # create a new Entry in JIRA in a given project
 
 
-import sys
-import json
 import datetime
+import heapq
+import random
+import signal
+import threading
+import time
 
 from optparse import OptionParser
 
-from launchpadlib.launchpad import Launchpad
-from jira import JIRA
-from LpToJira.jira_api import jira_api
+from LpToJira.jira_api import jira_connect
+from LpToJira.launchpad_api import lp_login
+from LpToJira.lp_jira_db import active_statuses, lp_jira_db
 
 
 jira_server = ""
 jira_project = ""
 
-db_json = "lp_to_jira_db.json"
 
-def get_bug_id(summary):
-    "Extract the bug id from a jira title whivh would icnlude LP#"
-    id = ""
-
-    if "LP#" in summary:
-        for char in summary[summary.find("LP#")+3:]:
-            if char.isdigit():
-                id = id + char
-            else:
-                break
-
-    return id
-
-def build_db(jira_api, lp_api, project):
-    # structure that contains all the LP/JIRA issues pair as well as the latest
-    # time it was modified in LP
-    db = {}
+def build_db(jira_api, lp_api, project, db):
+    """
+    Refresh db (see lp_jira_db) with what changed in project and return the
+    active LP/JIRA issues pairs as well as the latest time it was modified
+    in LP: {bug_id: {'JIRA_KEY': key, 'LAST_CHANGE': date}}
+    """
+    jira_lp_db = {}
 
     # 3.a search for all JIRA issues that starts with LP#
     print("Searching for JIRA issues ...", flush=True)
-    # Get JIRA issues in batch of 50
-
-    issue_index = 0
-    issue_batch = 50
-
-    while True:
-        start_index = issue_index * issue_batch
-        request = "project = {} " \
-            "AND summary ~ \"LP#\" " \
-            "AND status in (BLOCKED, Backlog, \"In Progress\", " \
-            "REVIEW,\"Selected for Development\")""".format(project)
-        issues = jira_api.search_issues(request, startAt=start_index)
-
-        if not issues:
-            break
-
-        issue_index += 1
-        for issue in issues:
-            print("#", flush=True, end="")
-            summary = issue.fields.summary
-            lpbug_id = get_bug_id(summary)
+    db.refresh(jira_api, project)
+
+    for entry in db.issues(project, active_statuses):
+        print("#", flush=True, end="")
+        last_change = entry['lp_updated']
+        # Only ask LP about bugs the database doesn't know about yet
+        if not last_change:
             try:
-                lpbug = lp_api.bugs[int(lpbug_id)]
-                db[lpbug_id] = {'JIRA_KEY' : issue.key,
-                    'LAST_CHANGE':"%s" % lpbug.date_last_updated}
+                lpbug = lp_api.bugs[entry['bug_id']]
+                last_change = "%s" % lpbug.date_last_updated
+                db.set_lp_updated(entry['jira_key'], last_change, commit=False)
             except Exception:
-                pass
+                continue
+
+        jira_lp_db[str(entry['bug_id'])] = {
+            'JIRA_KEY': entry['jira_key'],
+            'LAST_CHANGE': last_change}
+
+    db.commit()
+
+    return jira_lp_db
+
+
+class poll_scheduler():
+    """
+    Decide when to poll each bug. A bug is polled every interval seconds,
+    starting from interval, or longer the more days it has been quiet, up
+    to max_interval. The interval doubles each time the bug hasn't changed
+    and goes back to interval when it has. Polls are spread by +/- jitter
+    of their interval and no more than per_minute of them happen in a
+    minute
+    """
+
+    def __init__(self, interval=300, max_interval=6 * 3600, jitter=0.1,
+                 per_minute=60, clock=time.monotonic, rand=None):
+        if interval <= 0 or per_minute <= 0:
+            raise ValueError("interval and per_minute must be more than 0")
+
+        self.interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.jitter = jitter
+        self.per_minute = per_minute
+        self.clock = clock
+        self.rand = rand or random.Random()
+
+        self.queue = []
+        self.intervals = {}
+
+        # Token bucket holding up to a minute of requests
+        self.tokens = float(per_minute)
+        self.refilled = clock()
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def first_interval(self, last_change):
+        """Polling interval of a bug last changed at last_change"""
+        try:
+            age = datetime.datetime.now(datetime.timezone.utc) - \
+                datetime.datetime.fromisoformat(str(last_change))
+            days = max(age.days, 1)
+        except (TypeError, ValueError):
+            days = 1
+        return min(self.interval * days, self.max_interval)
+
+    def spread(self, interval):
+        return interval * self.rand.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def add(self, bug_id, last_change=None):
+        """
+        Schedule bug_id, its first poll is somewhere within its interval so
+        that the bugs don't all start at once
+        """
+        interval = self.first_interval(last_change)
+        self.intervals[bug_id] = interval
+        heapq.heappush(
+            self.queue,
+            (self.clock() + self.rand.uniform(0, interval), bug_id))
+
+    def polled(self, bug_id, changed):
+        """Schedule the next poll of bug_id, polled and found changed or not"""
+        if changed:
+            interval = self.interval
+        else:
+            interval = min(self.intervals[bug_id] * 2, self.max_interval)
+        self.intervals[bug_id] = interval
+        heapq.heappush(
+            self.queue, (self.clock() + self.spread(interval), bug_id))
+
+    def budget_wait(self, now):
+        """Seconds until the budget allows one more request"""
+        rate = self.per_minute / 60
+        self.tokens = min(
+            self.tokens + (now - self.refilled) * rate, self.per_minute)
+        self.refilled = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / rate
+
+    def next(self):
+        """
+        Return (bug_id, 0) with the bug to poll now, taking it out of the
+        schedule until polled() is called, or (None, seconds) to wait
+        before asking again
+        """
+        if not self.queue:
+            return None, self.interval
+
+        now = self.clock()
+        due, bug_id = self.queue[0]
+        wait = max(due - now, self.budget_wait(now))
+        if wait > 0:
+            return None, wait
+
+        heapq.heappop(self.queue)
+        self.tokens -= 1
+        return bug_id, 0
+
+
+def poll_bug(lp_api, db, jira_lp_db, bug):
+    """
+    Look up bug in Launchpad, return True and record its new date in db and
+    jira_lp_db if it changed since the last poll
+    """
+    old_date = jira_lp_db[bug]['LAST_CHANGE']
+    current_date = "%s" % lp_api.bugs[int(bug)].date_last_updated
+    if current_date == old_date:
+        return False
+
+    print("%s has changed since last refresh" % bug)
+    # TODO: compare issues and update JIRA item accordingly
+    # TODO: We could think of policy allowing to only update certain field
+    # like description, title
+    db.set_lp_updated(jira_lp_db[bug]['JIRA_KEY'], current_date)
+    jira_lp_db[bug]['LAST_CHANGE'] = current_date
+    return True
+
+
+def monitor(lp_api, db, jira_lp_db, scheduler, stop):
+    """
+    Poll the bugs of jira_lp_db (see build_db) when scheduler says so until
+    the threading.Event stop is set
+    """
+    for bug, entry in jira_lp_db.items():
+        scheduler.add(bug, entry['LAST_CHANGE'])
+
+    while not stop.is_set():
+        bug, wait = scheduler.next()
+        if bug is None:
+            stop.wait(wait)
+            continue
+
+        try:
+            changed = poll_bug(lp_api, db, jira_lp_db, bug)
+        except Exception as err:
+            print("Couldn't check %s: %s" % (bug, err))
+            changed = False
+        scheduler.polled(bug, changed)
 
-    return db
 
 def main():
     global jira_server
     usage = """\
-usage: lp-to-jira-monitor project-id
+usage: lp-to-jira-monitor [options] project-id
 
 Examples:
     lp-to-jira-monitor FR
+    lp-to-jira-monitor --interval 60 --per-minute 30 FR
     """
     opt_parser = OptionParser(usage)
+    opt_parser.add_option(
+        '--db', dest='db',
+        help='Keep the LP/JIRA mapping in the database FILE')
+    opt_parser.add_option(
+        '--interval', dest='interval', type='float', default=300,
+        help='Poll recently changed bugs every INTERVAL seconds, quiet '
+             'ones less often (default 300)')
+    opt_parser.add_option(
+        '--max-interval', dest='max_interval', type='float',
+        default=6 * 3600,
+        help='Poll every bug at least every MAX_INTERVAL seconds '
+             '(default 21600)')
+    opt_parser.add_option(
+        '--per-minute', dest='per_minute', type='int', default=60,
+        help='Make no more than PER_MINUTE Launchpad requests a minute '
+             '(default 60)')
     opts, args = opt_parser.parse_args()
 
+    if opts.interval <= 0:
+        opt_parser.error("--interval must be more than 0")
+    if opts.per_minute <= 0:
+        opt_parser.error("--per-minute must be more than 0")
+
     # # Make sure there's at least 1 arguments
     if len(args) < 1:
         opt_parser.print_usage()
@@ -90,46 +232,34 @@ Examples:
 
     # 1. Initialize JIRA API
     print("Initialize JIRA API ...")
-    api = jira_api()
-    jira_server = api.server
-    jira = JIRA(api.server, basic_auth=(api.login, api.token))
+    jira = jira_connect()
+    jira_server = jira.client_info()
 
     # TODO: catch exception if the Launchpad API isn't open
     # 2. Initialize Launchpad API
     print("Initialize Launchpad API ...")
-    lp = Launchpad.login_with('foundations', 'production', version='devel')
+    lp = lp_login()
 
-    try:
-        with open(db_json) as fp:
-            jira_lp_db = json.load(fp)
-        # TODO: check if there's new entry in JIRA that need to be added to the DB
-        # refresh_db(jira, lp, jira_project, jira_lp_db)
-    except (FileNotFoundError):
-        jira_lp_db = build_db(jira, lp, jira_project)
+    db = lp_jira_db(opts.db)
+    jira_lp_db = build_db(jira, lp, jira_project, db)
 
     print("\nFound %s issues" % len(jira_lp_db))
-    # Saving DB to disk
-    with open(db_json, 'w') as fp:
-            json.dump(jira_lp_db, fp, indent=2)
-
-    has_changed = False
-    while not has_changed:
-        print("Searching for changes %s" % datetime.datetime.now())
-        for bug in jira_lp_db:
-            try:
-                old_date = jira_lp_db[bug]['LAST_CHANGE']
-                current_date = "%s" % lp.bugs[int(bug)].date_last_updated
-                if  current_date!= old_date:
-                    has_changed = True
-                    print("%s has changed since last refresh" % bug)
-                    # TODO: compare issues and update JIRA item accordingly
-                    # TODO: then replace date in db
-                    # TODO: We could think of policy allowing to only update certain field like description, title
 
-            except Exception:
-                pass
+    # Stop between two polls on SIGTERM or ^C
+    stop = threading.Event()
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, lambda *args: stop.set())
+
+    print("Monitoring changes from %s" % datetime.datetime.now())
+    monitor(lp, db, jira_lp_db,
+            poll_scheduler(opts.interval, opts.max_interval,
+                           per_minute=opts.per_minute),
+            stop)
+    db.close()
 
     return 0
 
-main()
+
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# Buffer the changes lp-to-jira makes to Launchpad bugs so each bug is
+# saved once, optionally from a background thread retrying failed saves
+
+
+import queue
+import threading
+import time
+
+
+class lp_bug_update():
+    """Pending changes to a Launchpad bug, written with a single lp_save()"""
+
+    def __init__(self, bug):
+        self.bug = bug
+        self.description = []
+        self.tags = []
+
+    def append_description(self, text):
+        self.description.append(text)
+
+    def add_tag(self, tag):
+        self.tags.append(tag)
+
+    def __bool__(self):
+        return bool(self.description or self.tags)
+
+    @property
+    def bug_link(self):
+        """API link of the bug, for a snapshot or a launchpadlib bug"""
+        return getattr(self.bug, 'bug_link', None) or self.bug.self_link
+
+    def apply(self):
+        """
+        Apply the changes on top of the current state of the bug, skipping
+        those already there so applying again after a refresh is harmless
+        """
+        for text in self.description:
+            if text not in self.bug.description:
+                self.bug.description += text
+
+        new_tags = [tag for tag in self.tags if tag not in self.bug.tags]
+        if new_tags:
+            self.bug.tags += new_tags
+
+    def save(self):
+        if self:
+            self.apply()
+            self.bug.lp_save()
+
+
+class lp_writeback_queue():
+    """
+    Save lp_bug_update objects from a background thread, retrying up to
+    retries times with an exponential delay when Launchpad fails.
+    launchpadlib objects can't be shared between threads, with connect
+    the bug of each update is loaded from its link through the Launchpad
+    session connect() returns in the background thread
+    """
+
+    def __init__(self, connect=None, retries=3, delay=2):
+        self.connect = connect
+        self.retries = retries
+        self.delay = delay
+        self.failed = {}
+        self.updates = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, update):
+        if update:
+            self.updates.put(update)
+
+    def run(self):
+        while True:
+            update = self.updates.get()
+            if update is None:
+                return
+            self.write(update)
+
+    def write(self, update):
+        error = None
+        for attempt in range(self.retries + 1):
+            try:
+                if attempt:
+                    # Start again from what is in Launchpad now
+                    time.sleep(self.delay * 2 ** (attempt - 1))
+                    update.bug.lp_refresh()
+                elif self.connect:
+                    update.bug = self.connect().load(update.bug_link)
+                update.save()
+                return
+            except Exception as err:
+                error = err
+
+        self.failed[update.bug.id] = error
+
+    def close(self):
+        """
+        Wait for every pending update to be written and return a dict of
+        the bug IDs that couldn't be saved with the last error
+        """
+        self.updates.put(None)
+        self.thread.join()
+        return self.failed
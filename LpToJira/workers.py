@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# Helpers running lp-to-jira work items through a bounded pool of threads
+# while keeping the console output in a predictable order
+
+
+import io
+import sys
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# One semaphore per remote host, shared by every connection to that host
+host_slots = {}
+host_slots_lock = threading.Lock()
+
+# The stdout_router installed as sys.stdout while any run_ordered is running,
+# run_ordered generators can be nested when their results are streamed
+shared_router = None
+shared_router_users = 0
+shared_router_lock = threading.Lock()
+
+
+class stdout_router(io.TextIOBase):
+    """
+    Stand-in for sys.stdout sending what worker threads print into a
+    per-thread buffer, anything else goes through to the real stream
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def capture(self):
+        self.local.buffer = io.StringIO()
+
+    def release(self):
+        buffer = self.local.buffer
+        self.local.buffer = None
+        return buffer.getvalue()
+
+    def write(self, data):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(data)
+        return buffer.write(data)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+
+def limit_requests(connection, host, limit):
+    """
+    Make sure no more than limit requests go through connection.request
+    at once for all the connections limited under the same host name
+    """
+    with host_slots_lock:
+        if host not in host_slots:
+            host_slots[host] = threading.BoundedSemaphore(limit)
+        slots = host_slots[host]
+
+    request = connection.request
+
+    def limited_request(*args, **kwargs):
+        with slots:
+            return request(*args, **kwargs)
+
+    connection.request = limited_request
+    return connection
+
+
+def route_stdout():
+    """Install the shared stdout_router as sys.stdout and return it"""
+    global shared_router, shared_router_users
+
+    with shared_router_lock:
+        if not shared_router_users:
+            shared_router = stdout_router(sys.stdout)
+            sys.stdout = shared_router
+        shared_router_users += 1
+        return shared_router
+
+
+def unroute_stdout():
+    """Put back the original sys.stdout once no run_ordered needs routing"""
+    global shared_router, shared_router_users
+
+    with shared_router_lock:
+        shared_router_users -= 1
+        if not shared_router_users:
+            sys.stdout = shared_router.stream
+            shared_router = None
+
+
+def run_ordered(func, items, jobs=1):
+    """
+    Call func(item) for each item using up to jobs threads.
+    Yield (item, result, error) tuples in the order of items, error being
+    the exception raised by func if any. Whatever func prints is replayed
+    on stdout in that same order once its item is done.
+    items are consumed as the work goes, a few items ahead of the results,
+    so that they can be streamed.
+    """
+    if jobs <= 1:
+        for item in items:
+            try:
+                yield item, func(item), None
+            except Exception as err:
+                yield item, None, err
+        return
+
+    router = route_stdout()
+
+    def run(item):
+        router.capture()
+        try:
+            return func(item), None, router.release()
+        except Exception as err:
+            return None, err, router.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            pending = deque()
+            items = iter(items)
+            while True:
+                # Keep every worker busy with the next items
+                for item in items:
+                    pending.append((item, executor.submit(run, item)))
+                    if len(pending) >= 2 * jobs:
+                        break
+
+                if not pending:
+                    break
+
+                item, future = pending.popleft()
+                result, error, output = future.result()
+                router.stream.write(output)
+                router.stream.flush()
+                yield item, result, error
+    finally:
+        unroute_stdout()
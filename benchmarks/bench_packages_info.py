@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# Measure the memory the packages and series of lp_bug take for 10k bugs,
+# compared to the nested dicts lp_bug used to keep for each bug
+#
+# usage: python3 benchmarks/bench_packages_info.py [bugs]
+
+
+import sys
+import json
+import random
+import tracemalloc
+
+from LpToJira.lp_bug import parse_bug_tasks, ubuntu_devel, ubuntu_version
+
+
+packages = ["systemd", "glibc", "linux", "vim", "curl", "openssl",
+            "python3.10", "snapd", "netplan.io", "ubuntu-release-upgrader"]
+statuses = ["New", "Confirmed", "Triaged", "Fix Released", "Won't Fix"]
+importances = ["Undecided", "Low", "Medium", "High", "Critical"]
+
+
+class task():
+    __slots__ = ['bug_target_name', 'status', 'importance']
+
+    def __init__(self, entry):
+        self.bug_target_name = entry['bug_target_name']
+        self.status = entry['status']
+        self.importance = entry['importance']
+
+
+def bug_tasks(rand):
+    """
+    Tasks of a random bug, decoded from JSON as they come from Launchpad
+    so that every bug has its own copy of the strings
+    """
+    entries = []
+    for package in rand.sample(packages, rand.randint(1, 3)):
+        for serie in rand.sample(list(ubuntu_version), rand.randint(1, 4)):
+            name = "{} (Ubuntu{})".format(
+                package, "" if serie == ubuntu_devel else " " + serie)
+            entries.append({
+                'bug_target_name': name,
+                'status': rand.choice(statuses),
+                'importance': rand.choice(importances)})
+    return [task(entry) for entry in json.loads(json.dumps(entries))]
+
+
+def nested_packages_info(bug_tasks):
+    """What lp_bug kept for each bug before, see lp_bug.packages_info"""
+    packages_info = {}
+    for task in bug_tasks:
+        task_name = task.bug_target_name
+        if " (Ubuntu" in task_name:
+            package = packages_info.setdefault(task_name.split()[0], {})
+            serie = task_name[task_name.index("Ubuntu")+7:-1] or ubuntu_devel
+            package.setdefault("series", {})[serie] = {
+                "status": task.status,
+                "importance": task.importance}
+    return packages_info
+
+
+def measure(parse, bugs):
+    """
+    Return the bytes still taken once the tasks of bugs random bugs went
+    through parse() and are gone, with the parse() results
+    """
+    rand = random.Random(42)
+
+    tracemalloc.start()
+    tasks = [bug_tasks(rand) for _ in range(bugs)]
+    results = [parse(bug) for bug in tasks]
+    # The nested dicts keep the strings of the tasks alive
+    del tasks
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return size, results
+
+
+def main(bugs=10000):
+    print("{:25s} {:>12s} {:>12s}".format(
+        "packages of {} bugs".format(bugs), "MiB", "bytes/bug"))
+
+    for name, parse in [("nested dicts", nested_packages_info),
+                        ("interned records", parse_bug_tasks)]:
+        size, _ = measure(parse, bugs)
+        print("{:25s} {:12.2f} {:12.0f}".format(
+            name, size / 1024 / 1024, size / bugs))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
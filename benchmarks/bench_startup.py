@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# Measure the cold start time of the lp-to-jira entry points, that is what
+# every call of the snap from a script pays before doing any work
+#
+# usage: python3 benchmarks/bench_startup.py [runs]
+
+
+import sys
+import time
+import statistics
+import subprocess
+
+
+entry_points = {
+    "lp-to-jira --help":
+        "from LpToJira.lp_to_jira import main; main(['--help'])",
+    "lp-to-jira (usage error)":
+        "from LpToJira.lp_to_jira import main; main(['FR'])",
+    "lp-to-jira-report --help":
+        "from LpToJira.lp_to_jira_report import main; main(['--help'])",
+    "lp-to-jira-monitor --help":
+        "import sys; sys.argv = ['lp-to-jira-monitor', '--help']; "
+        "from LpToJira.lp_to_jira_sync import main; main()",
+}
+
+
+def cold_start(code):
+    """Return how long a new interpreter takes to run code, in seconds"""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", code],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main(runs=10):
+    baseline = [cold_start("pass") for _ in range(runs)]
+    print("{:30s} {:>10s} {:>10s}".format("entry point", "min (ms)", "median"))
+    print("{:30s} {:10.1f} {:10.1f}".format(
+        "python3 (baseline)",
+        min(baseline) * 1000,
+        statistics.median(baseline) * 1000))
+
+    for name, code in entry_points.items():
+        timings = [cold_start(code) for _ in range(runs)]
+        print("{:30s} {:10.1f} {:10.1f}".format(
+            name, min(timings) * 1000, statistics.median(timings) * 1000))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -1,8 +1,19 @@
+import json
 import pytest
 
 from unittest.mock import Mock
 
-from LpToJira.lp_bug import ubuntu_devel
+from lazr.restfulclient.errors import NotFound
+from lazr.uri import URI
+
+from LpToJira.lp_bug import lp_bugs, ubuntu_devel
+
+
+@pytest.fixture(autouse=True)
+def clear_lp_bugs():
+    """Don't let the lp_bug of a test leak into the next one"""
+    lp_bugs.clear()
+
 
 @pytest.fixture
 def lp_api():
@@ -161,8 +172,63 @@ def issue():
                 "Jammy": '',
                 "Impish": '',
                 "Hirsute": '',
+                "Groovy": '',
                 "Focal": '',
                 "Bionic": '',
                 "Xenial": '',
-                "Trusty": ''
+                "Trusty": '',
+                "Precise": '',
+                "LP Updated": ''
             }
+
+
+@pytest.fixture
+def lp_rest():
+    """
+    Launchpad API answering the raw requests of load_bug_snapshot, use
+    lp_rest.add_bug() to publish a bug
+    """
+    root = "https://api.launchpad.net/devel/"
+    resources = {}
+
+    def get(url):
+        if str(url).split("?")[0] not in resources:
+            raise NotFound(Mock(status=404), b"")
+        return json.dumps(resources[str(url).split("?")[0]]).encode()
+
+    def add_bug(id, title="", tasks=[], page_size=None):
+        bug_link = "{}bugs/{}".format(root, id)
+        tasks_link = bug_link + "/bug_tasks"
+        resources[bug_link] = {
+            'id': id,
+            'title': title,
+            'description': "This is the longer description",
+            'heat': 10,
+            'tags': [],
+            'web_link': "https://bugs.launchpad.net/bugs/{}".format(id),
+            'self_link': bug_link,
+            'date_last_updated': "2022-05-01T10:00:00.000000+00:00",
+            'bug_tasks_collection_link': tasks_link,
+        }
+        entries = [
+            {'bug_target_name': name,
+             'status': status,
+             'importance': importance}
+            for name, status, importance in tasks]
+        # Serve the tasks over several pages when page_size is set
+        page_size = page_size or len(entries) or 1
+        pages = [entries[i:i + page_size]
+                 for i in range(0, len(entries), page_size)] or [[]]
+        for n, page in enumerate(pages):
+            link = tasks_link if n == 0 else "{}/page{}".format(tasks_link, n)
+            resources[link] = {'entries': page}
+            if n + 1 < len(pages):
+                resources[link]['next_collection_link'] = \
+                    "{}/page{}".format(tasks_link, n + 1)
+
+    api = Mock()
+    api._root_uri = URI(root)
+    api._browser.get = Mock(side_effect=get)
+    api.add_bug = add_bug
+
+    return api
@@ -0,0 +1,121 @@
+import pytest
+
+from unittest.mock import Mock
+
+from jira.client import JIRAError, ResultList
+
+from LpToJira.jira_api import \
+    issue_search, jira_issue_cache, lazy_api, search_all_issues
+
+
+def test_lazy_api():
+    connect = Mock(return_value=Mock(server="https://jira"))
+    api = lazy_api(connect)
+
+    assert api
+    assert not api.connected
+    connect.assert_not_called()
+
+    assert api.server == "https://jira"
+    api.search_issues("project = AA")
+    assert api.connected
+    connect.assert_called_once()
+
+
+def test_search_all_issues():
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=[["AA-1", "AA-2"], ["AA-3"], []])
+
+    assert list(search_all_issues(jira, "project = AA", batch=2)) == \
+        ["AA-1", "AA-2", "AA-3"]
+    assert [call.kwargs['startAt']
+            for call in jira.search_issues.call_args_list] == [0, 2, 3]
+
+
+class result_page(list):
+    """A page of search results as returned by JIRA with the total count"""
+    def __init__(self, issues, total):
+        super().__init__(issues)
+        self.total = total
+
+
+def test_search_all_issues_parallel():
+    issues = ["AA-%d" % n for n in range(10)]
+
+    def search_issues(jql, startAt, maxResults, fields):
+        # The server only serves 3 issues per page
+        return result_page(issues[startAt:startAt + min(maxResults, 3)], 10)
+
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=search_issues)
+
+    assert list(search_all_issues(
+        jira, "project = AA", fields=["summary"], jobs=4)) == issues
+    assert sorted(call.kwargs['startAt']
+                  for call in jira.search_issues.call_args_list) == \
+        [0, 3, 6, 9]
+    assert all(call.kwargs['fields'] == ["summary"]
+               for call in jira.search_issues.call_args_list)
+
+
+def test_search_all_issues_cloud():
+    issues = ["AA-%d" % n for n in range(250)]
+
+    def page(start):
+        end = start + 100
+        return ResultList(
+            issues[start:end],
+            _nextPageToken=str(end) if end < len(issues) else None)
+
+    def search_issues(jql, startAt, maxResults, fields):
+        # JIRA Cloud only searches from the start
+        if startAt:
+            raise JIRAError("The `search` API is deprecated in Jira Cloud")
+        return page(0)
+
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=search_issues)
+    jira.enhanced_search_issues = Mock(
+        side_effect=lambda jql, nextPageToken, maxResults, fields:
+        page(int(nextPageToken)))
+
+    search = issue_search(jira, "project = AA")
+    assert list(search) == issues
+    assert search.complete
+    assert [call.kwargs['nextPageToken'] for call in
+            jira.enhanced_search_issues.call_args_list] == ["100", "200"]
+
+
+def test_search_all_issues_incomplete():
+    issues = ["AA-%d" % n for n in range(10)]
+
+    def search_issues(jql, startAt, maxResults, fields):
+        # An issue left the search while it was going through the pages
+        return ResultList(issues[startAt:startAt + 5] if startAt < 5 else
+                          issues[6:10], _total=10)
+
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=search_issues)
+
+    search = issue_search(jira, "project = AA")
+    assert len(list(search)) == 9
+    assert not search.complete
+
+    jira.search_issues = Mock(side_effect=JIRAError("down"))
+    search = issue_search(jira, "project = AA")
+    with pytest.raises(JIRAError):
+        list(search)
+    assert not search.complete
+
+
+def test_jira_issue_cache():
+    jira = Mock()
+    jira.issue = Mock(side_effect=lambda key: Mock(key=key))
+    cache = jira_issue_cache(jira)
+
+    found = Mock(key="AA-1")
+    cache.add(found)
+
+    assert cache.get("AA-1") is found
+    assert cache.get("AA-2") is cache.get("AA-2")
+    jira.issue.assert_called_once_with("AA-2")
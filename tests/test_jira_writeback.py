@@ -0,0 +1,94 @@
+from unittest.mock import Mock
+
+from LpToJira.jira_writeback import \
+    describe_error,\
+    jira_comment,\
+    jira_transition,\
+    jira_update,\
+    jira_write_queue,\
+    retry_after,\
+    run_actions
+
+
+class jira_error(Exception):
+    """Looks like a JIRAError"""
+    def __init__(self, status_code, retry=None):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.text = "error {}".format(status_code)
+        self.response = Mock(
+            headers={'Retry-After': retry} if retry is not None else {})
+
+
+def test_retry_after():
+    assert retry_after(jira_error(429, "3")) == 3
+    assert retry_after(jira_error(503)) is None
+    assert retry_after(ValueError()) is None
+    assert describe_error(jira_error(404)) == "HTTP 404 error 404"
+
+
+def test_run_actions():
+    jira = Mock()
+    issue = Mock(key="AA-1")
+
+    run_actions(jira, [jira_comment(issue, "hello"),
+                       jira_update(issue, summary="new"),
+                       jira_transition(issue, "Done")])
+
+    jira.add_comment.assert_called_once_with(issue, "hello")
+    issue.update.assert_called_once_with(summary="new")
+    jira.transition_issue.assert_called_once_with(issue, transition="Done")
+
+
+def test_jira_write_queue():
+    done = []
+
+    def add_comment(issue, body):
+        done.append((issue.key, body))
+        if issue.key == "AA-2":
+            raise jira_error(403)
+
+    jira = Mock()
+    jira.add_comment = Mock(side_effect=add_comment)
+    jira.transition_issue = Mock(side_effect=[
+        jira_error(429, "0"), jira_error(502), None])
+
+    busy = Mock(key="AA-1")
+    forbidden = Mock(key="AA-2")
+
+    writes = jira_write_queue(jira, jobs=2, delay=0)
+    writes.put(jira_comment(busy, "first"), jira_transition(busy, "Done"))
+    writes.put(jira_comment(forbidden, "first"),
+               jira_update(forbidden, summary="new"))
+    writes.put(jira_comment(busy, "second"))
+
+    failed = writes.close()
+
+    # Each issue's actions ran in order, the transition after two retries
+    assert [body for key, body in done if key == "AA-1"] == \
+        ["first", "second"]
+    assert jira.transition_issue.call_count == 3
+
+    # No retry on a 403 and what came next for that issue was dropped
+    assert [str(action) for action, _ in failed] == \
+        ["comment on AA-2", "update of AA-2 summary"]
+    assert failed[0][1].status_code == 403
+    forbidden.update.assert_not_called()
+
+
+def test_jira_write_queue_comment_retry():
+    jira = Mock()
+    jira.add_comment = Mock(side_effect=[
+        jira_error(429, "0"), None, jira_error(502)])
+
+    writes = jira_write_queue(jira, jobs=1, delay=0)
+    writes.put(jira_comment(Mock(key="AA-1"), "rejected then added"))
+    writes.put(jira_comment(Mock(key="AA-2"), "maybe added"))
+
+    failed = writes.close()
+
+    # The comment JIRA turned down is added again, not the one that may
+    # already be there after a 502
+    assert jira.add_comment.call_count == 3
+    assert [str(action) for action, _ in failed] == ["comment on AA-2"]
+    assert failed[0][1].status_code == 502
@@ -0,0 +1,37 @@
+import os
+
+from unittest.mock import Mock
+
+from LpToJira.launchpad_api import evict_cache, lp_cache_stats
+
+
+def test_evict_cache(tmp_path):
+    for n in range(5):
+        path = tmp_path / "entry{}".format(n)
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (n, n))
+
+    assert evict_cache(str(tmp_path), 1000) == 0
+    assert evict_cache(str(tmp_path), 250) == 3
+    assert sorted(os.listdir(tmp_path)) == ["entry3", "entry4"]
+
+
+def test_lp_cache_stats():
+    responses = [Mock(fromcache=True), Mock(fromcache=False),
+                 Mock(fromcache=True), Mock(fromcache=False)]
+    connection = Mock()
+    connection.cache._cache_dir = "/cache"
+    connection.request = Mock(
+        side_effect=[(response, b"") for response in responses])
+
+    stats = lp_cache_stats()
+    stats.watch(connection)
+
+    connection.request("https://api/bugs/1")
+    connection.request("https://api/bugs/2", "GET")
+    connection.request("https://api/bugs/1", "GET")
+    connection.request("https://api/bugs/1", "PATCH")
+
+    assert (stats.hits, stats.misses) == (2, 1)
+    assert stats.cache_dirs == {"/cache"}
+    assert str(stats) == "Launchpad cache: 2 hits, 1 misses (67% hit rate)"
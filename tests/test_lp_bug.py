@@ -1,6 +1,12 @@
+import json
 import pytest
 
-from LpToJira.lp_bug import lp_bug, ubuntu_devel, ubuntu_version
+from datetime import datetime, timezone
+from unittest.mock import Mock
+
+from LpToJira.lp_bug import lp_bug, lp_bug_cache, ubuntu_devel, ubuntu_version
+from LpToJira.lp_bug import parse_bug_tasks, task_record
+from LpToJira.lp_snapshot import load_bug_snapshot
 
 
 def test_bug_init_bad_lp_api():
@@ -112,4 +118,117 @@ def test_bug_repr(lp_api):
 
     assert bug.__repr__() == bug_dict.__str__()
 
+
+
+def test_lazy_fields(lp_api):
+    class counted_bug():
+        title = "lazy"
+        heat = 5
+        reads = 0
+
+        @property
+        def bug_tasks(self):
+            self.reads += 1
+            return [Mock(bug_target_name="vim (Ubuntu Jammy)",
+                         status="New", importance="Low")]
+
+    bug_data = counted_bug()
+    bug = lp_bug(7, lp_api, bug_data)
+
+    assert bug.title == "lazy"
+    assert bug.heat == 5
+    assert bug_data.reads == 0
+
+    assert bug.affected_packages == ['vim']
+    assert bug.affected_series('vim') == ['Jammy']
+    assert bug_data.reads == 1
+
+
+def test_from_dict(lp_rest):
+    lp_rest.add_bug(6, "dict", [('systemd (Ubuntu)', 'New', 'Critical'),
+                                ('systemd (Ubuntu Jammy)', 'New', 'Low')])
+    bug = lp_bug(6, lp_rest, load_bug_snapshot(lp_rest, 6))
+
+    copy = lp_bug.from_dict(json.loads(json.dumps(bug.dict(full=True))))
+
+    assert copy.dict(full=True) == bug.dict(full=True)
+    assert str(copy) == str(bug)
+    assert copy.date_last_updated == \
+        datetime(2022, 5, 1, 10, tzinfo=timezone.utc)
+
+    # What dict() gives without full is enough for the packages
+    assert lp_bug.from_dict(bug.dict()).package_detail(
+        "systemd", ubuntu_devel, "status") == "New"
+
+
+def test_from_snapshot(lp_rest):
+    lp_rest.add_bug(8, "snap", [('vim (Ubuntu Focal)', 'Triaged', 'High')])
+
+    bug = lp_bug.from_snapshot(load_bug_snapshot(lp_rest, 8))
+
+    assert bug.id == 8
+    assert bug.title == "snap"
+    assert bug.package_detail("vim", "Focal", "importance") == "High"
+
+
+def test_compact_packages():
+    def tasks():
+        return [
+            Mock(bug_target_name="vim (Ubuntu)",
+                 status="New", importance="Low"),
+            Mock(bug_target_name="vim (Ubuntu Jammy)",
+                 status="Brand New Status", importance="Low")]
+
+    packages = parse_bug_tasks(tasks())
+    other = parse_bug_tasks(tasks())
+
+    # Records and names are shared between bugs
+    assert packages['vim'][ubuntu_devel] is other['vim'][ubuntu_devel]
+    assert list(packages)[0] is list(other)[0]
+    assert not hasattr(packages['vim']['Jammy'], '__dict__')
+    assert isinstance(packages['vim']['Jammy'], task_record)
+
+    bug = lp_bug.from_dict({'id': 1, 'title': "", 'packages': {}})
+    bug.packages = packages
+    assert bug.package_detail('vim', 'Jammy', 'status') == "Brand New Status"
+    assert bug.package_detail('vim', 'Jammy', 'age') == ""
+    assert bug.affected_versions('vim') == ['22.10', '22.04']
+    assert bug.packages_info == {'vim': {'series': {
+        ubuntu_devel: {'status': "New", 'importance': "Low"},
+        'Jammy': {'status': "Brand New Status", 'importance': "Low"}}}}
+
 # =============================================================================
+
+
+def test_lp_bug_cache(lp_api):
+    cache = lp_bug_cache(size=2)
+
+    bug = cache.get(1, lp_api)
+    assert cache.get("1", lp_api) is bug
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A bug updated since is built again
+    updated = Mock(title="updated", description="", heat=1,
+                   date_last_updated="later", bug_tasks=[])
+    assert cache.get(1, lp_api, updated).title == "updated"
+    assert cache.get(1, lp_api, updated) is cache.get(1, lp_api)
+
+    # The least recently used bugs go away past size
+    cache.get(2, lp_api)
+    cache.get(3, lp_api)
+    assert len(cache.bugs) == 2
+    assert 1 not in cache.latest
+    assert "hit rate" in str(cache)
+
+    # Several versions of a bug going away one after the other
+    cache = lp_bug_cache(size=3)
+    versions = [Mock(title=date, description="", heat=1,
+                     date_last_updated=date, bug_tasks=[])
+                for date in ["d1", "d2"]]
+    cache.get(1, lp_api, versions[1])
+    cache.get(1, lp_api, versions[0])
+    cache.get(1, lp_api, versions[1])
+    cache.size = 1
+    cache.get(2, lp_api)
+    assert list(cache.bugs) == [(2, lp_api.bugs[2].date_last_updated)]
+    assert list(cache.latest) == [2]
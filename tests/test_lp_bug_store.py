@@ -0,0 +1,103 @@
+import pytest
+
+from LpToJira.lp_bug import lp_bug
+from LpToJira.lp_bug_store import lp_bug_store
+
+
+def bug(id, title, status="New", updated="2022-05-01T10:00:00+00:00"):
+    return lp_bug.from_dict({
+        'id': id,
+        'title': title,
+        'packages': {'vim': {'series': {
+            'Jammy': {'status': status, 'importance': "Low"}}}},
+        'date_last_updated': updated})
+
+
+def test_lp_bug_store(tmp_path):
+    path = tmp_path / "bugs"
+
+    with lp_bug_store(path) as store:
+        for id in [30, 10, 20]:
+            store.append(bug(id, "bug {}".format(id)))
+        assert store.append(bug(10, "updated", "Fix Released",
+                                "2022-05-02T10:00:00+00:00"))
+
+        # Bugs that didn't change aren't stored again
+        size = path.stat().st_size
+        assert not store.append(bug(20, "unchanged"))
+        assert path.stat().st_size == size
+
+        assert store.get(10).title == "updated"
+        assert 20 in store and 40 not in store
+        with pytest.raises(KeyError):
+            store.get(40)
+
+    # Appended entries are found again once reopened
+    with lp_bug_store(path) as store:
+        assert store.ids() == [10, 20, 30]
+        assert store.get(10).package_detail(
+            "vim", "Jammy", "status") == "Fix Released"
+
+        size = path.stat().st_size
+        store.compact()
+        assert path.stat().st_size < size
+        assert store.sorted == 3 and not store.appended
+
+        store.append(bug(25, "after compaction"))
+        assert [b.title for b in store] == \
+            ["updated", "bug 20", "after compaction", "bug 30"]
+        assert str(store.get(30).date_last_updated) == \
+            "2022-05-01 10:00:00+00:00"
+
+    with lp_bug_store(path) as store:
+        assert len(store) == 4
+        assert store.get(20).title == "bug 20"
+
+
+def test_lp_bug_store_partial_index(tmp_path):
+    path = tmp_path / "bugs"
+    with lp_bug_store(path) as store:
+        store.append(bug(1, "bug 1"))
+        store.append(bug(2, "bug 2"))
+
+    # Interrupted while writing the index entry of bug 2
+    index = tmp_path / "bugs.idx"
+    index.write_bytes(index.read_bytes()[:-5])
+
+    with lp_bug_store(path) as store:
+        assert store.ids() == [1]
+        store.append(bug(2, "bug 2 again"))
+
+    with lp_bug_store(path) as store:
+        assert [b.title for b in store] == ["bug 1", "bug 2 again"]
+
+
+def test_lp_bug_store_mismatch(tmp_path):
+    path = tmp_path / "bugs"
+    with lp_bug_store(path) as store:
+        store.append(bug(2, "two"))
+        store.append(bug(1, "one"))
+        store.compact()
+        store.append(bug(1, "one again", updated="2022-06-01T10:00:00+00:00"))
+    with lp_bug_store(tmp_path / "other") as other:
+        other.append(bug(3, "three"))
+
+    # As if compact() stopped before replacing the index, with a record
+    # cut short too
+    (tmp_path / "other.idx").replace(tmp_path / "bugs.idx")
+    with open(path, "ab") as data:
+        data.write(b'{"id": 4, "ti')
+
+    with lp_bug_store(path) as store:
+        assert store.ids() == [1, 2]
+        assert store.get(1).title == "one again"
+        assert store.get(2).title == "two"
+        store.append(bug(4, "four"))
+        assert store.get(4).title == "four"
+
+    with lp_bug_store(path) as store:
+        assert store.ids() == [1, 2, 4]
+
+    (tmp_path / "other").write_text("not a store\n")
+    with pytest.raises(ValueError):
+        lp_bug_store(tmp_path / "other")
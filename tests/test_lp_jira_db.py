@@ -0,0 +1,164 @@
+import datetime
+import sqlite3
+
+from unittest.mock import Mock
+
+from jira.client import ResultList
+
+from LpToJira.lp_jira_db import lp_jira_db
+
+
+def jira_issue(key, summary, status, labels=()):
+    issue = Mock(key=key)
+    issue.fields.summary = summary
+    issue.fields.status.name = status
+    issue.fields.labels = list(labels)
+    return issue
+
+
+def test_refresh():
+    db = lp_jira_db(":memory:")
+    assert db.refreshed("AA") is None
+
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=[
+        [jira_issue("AA-1", "LP#123 [pkg] bug", "In Progress"),
+         jira_issue("AA-2", "LP#1234 [pkg] bug", "Done"),
+         jira_issue("AA-3", "No bug", "Backlog")],
+        []])
+
+    assert db.refresh(jira, "AA") == 2
+    assert "updated" not in jira.search_issues.call_args_list[0].args[0]
+    assert db.refreshed("AA") is not None
+    assert db.index("AA") == {123: "AA-1", 1234: "AA-2"}
+
+    # Only what changed since the previous refresh is fetched
+    jira.search_issues = Mock(side_effect=[
+        [jira_issue("AA-2", "LP#1234 [pkg] bug", "Backlog")],
+        []])
+    assert db.refresh(jira, "AA") == 1
+    assert "updated >= -1m" in jira.search_issues.call_args_list[0].args[0]
+
+    rows = db.issues("AA", ["backlog", "In Progress"])
+    assert [(row['jira_key'], row['jira_status']) for row in rows] == \
+        [("AA-1", "In Progress"), ("AA-2", "Backlog")]
+
+    assert db.index("BB") == {}
+
+
+def test_full_refresh(tmp_path):
+    path = str(tmp_path / "lp_to_jira.db")
+
+    # A database from before full refreshes
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE projects (project TEXT PRIMARY KEY, "
+                "refreshed TEXT)")
+    old.close()
+
+    db = lp_jira_db(path)
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=[
+        [jira_issue("AA-1", "LP#1 [pkg] bug", "Backlog"),
+         jira_issue("AA-2", "LP#2 [pkg] bug", "Backlog")],
+        []])
+    db.refresh(jira, "AA")
+    assert db.full_refreshed("AA") is not None
+
+    # AA-2 was deleted, only a full refresh can tell
+    jira.search_issues = Mock(side_effect=[[], []])
+    db.refresh(jira, "AA")
+    assert db.index("AA") == {1: "AA-1", 2: "AA-2"}
+
+    jira.search_issues = Mock(side_effect=[
+        [jira_issue("AA-1", "LP#1 [pkg] bug", "Backlog")], []])
+    assert db.refresh(jira, "AA", full=True) == 1
+    assert "updated" not in jira.search_issues.call_args_list[0].args[0]
+    assert db.index("AA") == {1: "AA-1"}
+
+    # Nothing is forgotten when the search may have missed issues
+    jira.search_issues = Mock(side_effect=[
+        ResultList([jira_issue("AA-3", "LP#3 [pkg] bug", "Backlog")],
+                   _total=2),
+        ResultList([], _total=2)])
+    full_refreshed = db.full_refreshed("AA")
+    db.refresh(jira, "AA", full=True)
+    assert db.index("AA") == {1: "AA-1", 3: "AA-3"}
+    assert db.full_refreshed("AA") == full_refreshed
+    db.db.execute("DELETE FROM issues WHERE jira_key = 'AA-3'")
+
+    # Full refreshes also happen on their own once in a while, unless only
+    # the changes are wanted
+    db.db.execute("UPDATE projects SET full_refresh = ?",
+                  ("2000-01-01T00:00:00+00:00",))
+    jira.search_issues = Mock(side_effect=[[], []])
+    db.refresh(jira, "AA", incremental=True)
+    assert "updated" in jira.search_issues.call_args_list[0].args[0]
+    assert db.index("AA") == {1: "AA-1"}
+
+    jira.search_issues = Mock(side_effect=[[], []])
+    db.refresh(jira, "AA")
+    assert db.index("AA") == {}
+
+
+def test_labels(tmp_path):
+    path = str(tmp_path / "lp_to_jira.db")
+
+    # A database from before labels were kept, fully refreshed already
+    old = sqlite3.connect(path)
+    old.executescript("""
+        CREATE TABLE issues (jira_key TEXT PRIMARY KEY, project TEXT,
+            bug_id INTEGER, summary TEXT, jira_status TEXT, lp_updated TEXT,
+            synced TEXT);
+        INSERT INTO issues VALUES ('AA-1', 'AA', 1, 'LP#1 [pkg] bug',
+            'Backlog', NULL, NULL);
+        CREATE TABLE projects (project TEXT PRIMARY KEY, refreshed TEXT,
+            full_refresh TEXT);
+        INSERT INTO projects VALUES ('AA', '2000-01-01T00:00:00+00:00',
+            '2000-01-01T00:00:00+00:00');
+    """)
+    old.close()
+
+    db = lp_jira_db(path)
+    assert db.issues("AA")[0]['labels'] is None
+    assert db.full_refreshed("AA") is None
+
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=[
+        [jira_issue("AA-1", "LP#1 [pkg] bug", "Backlog",
+                    ["DisableLPSync", "foo"])],
+        []])
+    db.refresh(jira, "AA")
+    assert "updated" not in jira.search_issues.call_args_list[0].args[0]
+    assert db.issues("AA")[0]['labels'] == "DisableLPSync foo"
+
+    # Unknown labels don't overwrite the ones stored
+    db.add_issue("AA", 1, "AA-1")
+    assert db.issues("AA")[0]['labels'] == "DisableLPSync foo"
+
+
+def test_add_issue():
+    db = lp_jira_db(":memory:")
+
+    db.add_issue("AA", 1, "AA-1", "LP#1 [pkg] bug", "Backlog")
+    db.add_issue("AA", 1, "AA-1")
+    db.set_lp_updated("AA-1", "2022-01-01 00:00:00+00:00")
+
+    row = db.issues("AA")[0]
+    assert row['summary'] == "LP#1 [pkg] bug"
+    assert row['jira_status'] == "Backlog"
+    assert row['lp_updated'] == "2022-01-01 00:00:00+00:00"
+    assert row['synced']
+
+
+def test_watermark():
+    db = lp_jira_db(":memory:")
+    assert db.watermark("ubuntu -> AA") is None
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db.set_watermark("ubuntu -> AA", now)
+    assert db.watermark("ubuntu -> AA") == now
+
+    # Never goes backward
+    db.set_watermark("ubuntu -> AA", now - datetime.timedelta(days=1))
+    assert db.watermark("ubuntu -> AA") == now
+    assert db.watermark("ubuntu -> BB") is None
@@ -0,0 +1,52 @@
+import pytest
+
+from datetime import datetime, timezone
+
+from LpToJira.lp_bug import lp_bug, ubuntu_devel
+from LpToJira.lp_snapshot import load_bug_snapshot, snapshot_requests
+from LpToJira.lp_to_jira import build_jira_issue, get_lp_bug_pkg
+
+
+def test_load_bug_snapshot(lp_rest):
+    lp_rest.add_bug(1, "A bug", [
+        ('systemd (Ubuntu)', 'New', 'High'),
+        ('systemd (Ubuntu Focal)', 'Confirmed', 'High'),
+        ('vim (Debian)', 'New', 'Low')])
+
+    requests = snapshot_requests.requests
+    snapshot = load_bug_snapshot(lp_rest, 1)
+
+    assert snapshot.requests == 2
+    assert snapshot_requests.requests == requests + 2
+    assert snapshot.id == 1
+    assert snapshot.title == "A bug"
+    assert snapshot.date_last_updated == \
+        datetime(2022, 5, 1, 10, tzinfo=timezone.utc)
+    assert [task.bug_target_name for task in snapshot.bug_tasks] == \
+        ['systemd (Ubuntu)', 'systemd (Ubuntu Focal)', 'vim (Debian)']
+    assert "ws.size=300" in str(lp_rest._browser.get.call_args.args[0])
+
+    bug = lp_bug(1, lp_rest, snapshot)
+    assert bug.affected_packages == ['systemd']
+    assert bug.affected_series('systemd') == [ubuntu_devel, 'Focal']
+    assert bug.package_detail('systemd', 'Focal', 'status') == 'Confirmed'
+
+    assert get_lp_bug_pkg(snapshot) == 'systemd'
+    assert build_jira_issue(None, snapshot, "AA")['summary'] == \
+        "LP#1 [systemd] A bug"
+
+
+def test_load_bug_snapshot_pages(lp_rest):
+    lp_rest.add_bug(2, "Many tasks", [
+        ('pkg{} (Ubuntu)'.format(n), 'New', 'Low') for n in range(5)],
+        page_size=2)
+
+    snapshot = load_bug_snapshot(lp_rest, 2)
+
+    assert snapshot.requests == 4
+    assert len(snapshot.bug_tasks) == 5
+
+
+def test_load_bug_snapshot_missing(lp_rest):
+    with pytest.raises(KeyError):
+        load_bug_snapshot(lp_rest, 3)
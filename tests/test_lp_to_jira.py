@@ -1,15 +1,24 @@
+import json
+import argparse
 import pytest
 
+from datetime import datetime, timezone
 from unittest.mock import Mock
 
+from LpToJira.lp_jira_db import lp_jira_db
 from LpToJira.lp_to_jira import\
     build_jira_issue,\
     create_jira_issue,\
+    create_jira_issues,\
+    apply_plan,\
+    plan_project_sync,\
     get_lp_bug,\
     get_lp_bug_pkg,\
     get_all_lp_project_bug_tasks,\
+    get_jira_bug_index,\
     is_bug_in_jira,\
-    lp_to_jira_bug
+    lp_to_jira_bug,\
+    sync_scope
 
 
 def test_get_lp_bug(lp):
@@ -66,6 +75,11 @@ def test_get_lp_project_bug_tasks(lp):
     # project curtin exists and has a bug
     assert get_all_lp_project_bug_tasks(lp, "curtin", 5).id == 123456
 
+    since = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    get_all_lp_project_bug_tasks(lp, "curtin", modified_since=since)
+    assert lp.projects["curtin"].searchTasks.call_args.kwargs[
+        'modified_since'] == "2022-01-01T00:00:00+00:00"
+
 
 def test_is_bug_in_jira():
     jira = Mock()
@@ -85,6 +99,31 @@ def test_is_bug_in_jira():
     assert is_bug_in_jira(jira, bug, "AA") == True
 
 
+def test_get_jira_bug_index():
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=[
+        [Mock(key="AA-1", fields=Mock(summary="LP#123 [pkg] a bug")),
+         Mock(key="AA-2", fields=Mock(summary="LP#1234 [pkg] another")),
+         Mock(key="AA-3", fields=Mock(summary="no LP reference"))],
+        [Mock(key="AA-4", fields=Mock(summary="LP#123 [pkg] duplicate"))],
+        []])
+
+    assert get_jira_bug_index(jira, "AA") == {123: "AA-1", 1234: "AA-2"}
+    assert jira.search_issues.call_args.kwargs['startAt'] == 4
+
+
+def test_is_bug_in_jira_index():
+    jira = Mock()
+    jira.client_info = Mock(return_value="jira_client_info")
+
+    bug = Mock()
+    bug.id = 123
+
+    assert is_bug_in_jira(jira, bug, "AA", {1234: "AA-2"}) == False
+    assert is_bug_in_jira(jira, bug, "AA", {123: "AA-1"}) == True
+    jira.search_issues.assert_not_called()
+
+
 def test_build_jira_issue(empty_bug):
     # TODO improve coverage to test for non empty bug
     default_jira_bug = {'project': '',
@@ -115,6 +154,155 @@ def test_create_jira_issue(empty_bug, capsys):
     #     object={'url': 'https://', 'title': 'Launchpad Link'})
 
 
+def test_create_jira_issues(capsys):
+    jira = Mock()
+    jira.client_info = Mock(return_value="jira")
+    jira.project = Mock(return_value=Mock(id="10"))
+    jira.create_issues = Mock(return_value=[
+        {'status': 'Success', 'issue': Mock(key="AA-1", id="1"),
+         'error': None},
+        {'status': 'Error', 'issue': None, 'error': {'summary': 'bad'}},
+        {'status': 'Success', 'issue': Mock(key="AA-3", id="3"),
+         'error': None}])
+
+    bugs = [Mock(id=n, web_link="https://pad.lv/%d" % n) for n in [1, 2, 3]]
+    pending = [(bug, {'project': 'AA', 'summary': "LP#%d" % bug.id})
+               for bug in bugs]
+
+    opts = Mock(epic="AA-100")
+    results = create_jira_issues(jira, pending, opts)
+
+    assert [(bug.id, error) for bug, _, error in results] == \
+        [(1, None), (2, {'summary': 'bad'}), (3, None)]
+    assert [issue.key for _, issue, _ in results if issue] == ["AA-1", "AA-3"]
+
+    # The project is resolved once and each issue created in one request
+    jira.project.assert_called_once_with('AA')
+    field_list = jira.create_issues.call_args.args[0]
+    assert [fields['project'] for fields in field_list] == [{'id': "10"}] * 3
+    assert jira.add_simple_link.call_count == 2
+    jira.add_issues_to_epic.assert_called_once_with("AA-100", ["1", "3"])
+
+    assert "jira/browse/AA-1" in capsys.readouterr().out
+    assert create_jira_issues(jira, [], opts) == []
+
+    # A failed request is reported for each bug
+    from jira import JIRAError
+    error = JIRAError(status_code=503, text="unavailable")
+    jira.create_issues = Mock(side_effect=error)
+    assert create_jira_issues(jira, pending, opts) == \
+        [(bug, None, error) for bug in bugs]
+
+
+def test_plan_and_apply(lp_rest, monkeypatch):
+    bugs = {}
+    for n in [1, 2, 3]:
+        lp_rest.add_bug(n, "bug %d" % n, [('systemd (Ubuntu)', 'New', 'Low')])
+        bugs[n] = Mock(id=n, description="", tags=[])
+    tasks = [Mock(bug_link="https://api/bugs/%d" % n) for n in [1, 2, 3]]
+    untagged_tasks = tasks + [Mock(bug_link="https://api/bugs/4")]
+
+    lp = lp_rest
+    lp.projects = {"ubuntu": Mock()}
+    lp.projects["ubuntu"].searchTasks = Mock(
+        side_effect=lambda tags, **kwargs: tasks if tags else untagged_tasks)
+    lp.load = Mock(side_effect=lambda link: bugs[int(link[-1])])
+    # The Launchpad session of the write-back thread
+    monkeypatch.setattr("LpToJira.lp_to_jira.thread_lp", lambda limit: lp)
+
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=[
+        [Mock(key="AA-2", fields=Mock(summary="LP#2 [systemd] bug 2"))],
+        []])
+    jira.project = Mock(return_value=Mock(id="10"))
+    jira.create_issues = Mock(return_value=[
+        {'status': 'Success', 'issue': Mock(key="AA-5", id="5")},
+        {'status': 'Success', 'issue': Mock(key="AA-6", id="6")}])
+
+    opts = argparse.Namespace(
+        sync_project_bugs="ubuntu", project="AA", days=None,
+        tags=["go-to-jira"], incremental=False, jobs=1, max_per_host=4,
+        label=None, component=None, epic=None, lp_link=False,
+        no_lp_tag=False)
+
+    plan, loaded = plan_project_sync(lp, jira, opts, filtered=True)
+
+    assert [entry['bug'] for entry in plan['create']] == [1, 3]
+    assert plan['skip'] == [{'bug': 2, 'jira': "AA-2"}]
+    assert plan['filtered'] == [{'bug': 4}]
+    assert plan['api_calls'] == {'jira': 4, 'launchpad': 4}
+    jira.create_issues.assert_not_called()
+    for bug in bugs.values():
+        bug.lp_save.assert_not_called()
+
+    # Apply the plan as read back from disk
+    plan = json.loads(json.dumps(plan))
+    assert apply_plan(lp, jira, plan, opts) == 0
+
+    assert [fields['summary'] for fields in
+            jira.create_issues.call_args.args[0]] == \
+        ["LP#1 [systemd] bug 1", "LP#3 [systemd] bug 3"]
+    assert bugs[1].tags == ["aa-5"]
+    assert bugs[3].tags == ["aa-6"]
+    bugs[2].lp_save.assert_not_called()
+
+    # Only a saved plan looks for the bugs left out by the tags
+    lp.projects["ubuntu"].searchTasks.reset_mock()
+    jira.search_issues = Mock(return_value=[])
+    plan, _ = plan_project_sync(lp, jira, opts)
+    assert plan['filtered'] == []
+    lp.projects["ubuntu"].searchTasks.assert_called_once()
+
+
+def test_apply_plan_again(monkeypatch):
+    bugs = {n: Mock(id=n, description="", tags=[]) for n in [1, 2]}
+    lp = Mock()
+    lp.load = Mock(side_effect=lambda link: bugs[int(link[-1])])
+    monkeypatch.setattr("LpToJira.lp_to_jira.thread_lp", lambda limit: lp)
+
+    jira = Mock()
+    jira.project = Mock(return_value=Mock(id="10"))
+    jira.create_issues = Mock(return_value=[
+        {'status': 'Success', 'issue': Mock(key="AA-5", id="5")},
+        {'status': 'Error', 'issue': None, 'error': "busy"}])
+
+    plan = {
+        'project': "AA",
+        'options': {'epic': None, 'lp_link': False, 'no_lp_tag': False},
+        'create': [
+            {'bug': n, 'web_link': "https://pad.lv/%d" % n,
+             'bug_link': "https://api/bugs/%d" % n,
+             'issue': {'project': "AA", 'summary': "LP#%d" % n}}
+            for n in [1, 2]],
+        'failed': [],
+        'watermark': None,
+    }
+    opts = argparse.Namespace(max_per_host=4)
+    db = lp_jira_db(":memory:")
+
+    assert apply_plan(lp, jira, plan, opts, db) == 1
+    assert db.index("AA") == {1: "AA-5"}
+
+    # Only the issue that failed is created the second time
+    jira.create_issues = Mock(return_value=[
+        {'status': 'Success', 'issue': Mock(key="AA-6", id="6")}])
+    assert apply_plan(lp, jira, plan, opts, db) == 0
+    assert [fields['summary'] for fields in
+            jira.create_issues.call_args.args[0]] == ["LP#2"]
+    assert db.index("AA") == {1: "AA-5", 2: "AA-6"}
+    assert bugs[1].tags == ["aa-5"]
+
+
+def test_sync_scope():
+    opts = argparse.Namespace(
+        sync_project_bugs="ubuntu", project="AA", tags=["b", "a"], days=None)
+    assert sync_scope(opts) == "ubuntu -> AA tags:a,b"
+
+    # A run limited to recent bugs has a watermark of its own
+    opts.days = 3
+    assert sync_scope(opts) == "ubuntu -> AA tags:a,b days:3"
+
+
 def test_lp_to_jira_bug(lp, empty_bug):
     jira = Mock()
 
@@ -1,10 +1,33 @@
+import os
+import json
+import datetime
+import pytest
+import sqlite3
+
 from unittest.mock import Mock
 
 
+from LpToJira.jira_api import jira_issue_cache
+from LpToJira.jira_writeback import jira_write_queue
+from LpToJira.lp_jira_db import lp_jira_db
+from LpToJira.lp_bug_store import lp_bug_store
 from LpToJira.lp_to_jira_report import \
+    csv_report,\
     find_issues_in_project,\
     get_bug_id,\
+    html_report,\
+    iter_issues_in_project,\
+    iter_lp_data,\
+    json_report,\
+    jsonl_report,\
+    load_previous_report,\
     merge_lp_data_with_jira_issues,\
+    new_report_entry,\
+    print_table,\
+    report_row,\
+    reusable_entries,\
+    row_stats,\
+    sqlite_report,\
     sync_title
 
 
@@ -77,3 +100,315 @@ def test_merge_lp_data_with_jira_issues():
          'LaunchPad ID': '3333'}
          ]
 
+
+
+def test_merge_lp_data_with_jira_issues_jobs(lp_rest, issue, monkeypatch):
+    monkeypatch.setattr(
+        "LpToJira.lp_to_jira_report.thread_lp", lambda: lp_rest)
+    lp_rest.add_bug(1, "bug 1", [('systemd (Ubuntu)', 'New', 'High'),
+                                 ('systemd (Ubuntu Focal)', 'New', 'High')])
+    lp_rest.add_bug(3, "bug 3", [('vim (Ubuntu Jammy)', 'Triaged', 'Low')])
+
+    for jobs in [1, 4]:
+        issues = [dict(issue, **{'JIRA ID': "KEY-%d" % n,
+                                 'LaunchPad ID': str(n)})
+                  for n in [1, 2, 3]]
+        merge_lp_data_with_jira_issues(Mock(), lp_rest, issues, jobs=jobs)
+
+        assert [entry['JIRA ID'] for entry in issues] == \
+            ["KEY-1", "KEY-2", "KEY-3"]
+        assert [entry['Packages'] for entry in issues] == \
+            ["systemd", "", "vim"]
+        assert issues[0]['Focal'] == "New"
+        assert issues[0]['Importance'] == "High"
+        assert issues[2]['Jammy'] == "Triaged"
+
+
+def test_report_writers(issue, tmp_path):
+    entries = [dict(issue, **{'JIRA ID': "KEY-%d" % n}) for n in [1, 2]]
+
+    for count in [0, 1, 2]:
+        report = json_report(tmp_path / "report.json")
+        for entry in entries[:count]:
+            report.write(entry)
+        report.close()
+
+        assert (tmp_path / "report.json").read_text() == \
+            json.dumps(entries[:count], indent=2)
+
+    report = csv_report(tmp_path / "report.csv")
+    for entry in entries:
+        report.write(entry)
+    report.close()
+
+    print_table([list(issue.keys())] + [list(x.values()) for x in entries],
+                sep=";", limit=1024, align=False, draw_title=False,
+                file=tmp_path / "expected.csv")
+    assert (tmp_path / "report.csv").read_text() == \
+        (tmp_path / "expected.csv").read_text()
+
+
+def test_iter_lp_data_streams(lp_rest, issue, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "LpToJira.lp_to_jira_report.thread_lp", lambda: lp_rest)
+    for n in range(20):
+        lp_rest.add_bug(n, "bug", [('vim (Ubuntu)', 'New', 'Low')])
+
+    taken = []
+
+    def fetched_issues():
+        for n in range(20):
+            taken.append(n)
+            yield dict(issue, **{'LaunchPad ID': str(n)})
+
+    report = csv_report(tmp_path / "report.csv")
+    entries = iter_lp_data(Mock(), lp_rest, fetched_issues(), jobs=2)
+
+    # The first entry reaches the file long before the issues are all read
+    report.write(next(entries))
+    assert len(taken) < 20
+    assert "vim" in (tmp_path / "report.csv").read_text()
+
+    for entry in entries:
+        report.write(entry)
+    report.close()
+
+    assert len(taken) == 20
+    assert len((tmp_path / "report.csv").read_text().splitlines()) == 21
+
+
+def test_html_report(issue, tmp_path):
+    issue['Summary'] = "LP#123456 </script> in a title"
+
+    report = html_report(tmp_path / "report.html")
+    report.write(issue)
+    report.close()
+
+    html = (tmp_path / "report.html").read_text()
+    start = html.index("var rows = [\n") + 13
+    rows = html[start:html.index("];\n", start)]
+
+    # The rows are data for the page, not table cells
+    assert json.loads("[" + rows.rstrip(",\n") + "]") == \
+        [list(issue.values())]
+    assert "</script> in" not in html
+    assert '<tbody id="JIRA-LP-BODY"></tbody>' in html
+
+
+def test_queryable_reports(issue, tmp_path):
+    entries = [dict(issue, **{'JIRA ID': "KEY-%d" % n,
+                              'LaunchPad ID': str(n),
+                              'Heat': str(n * 10),
+                              'Focal': "New"})
+               for n in [1, 2, 3]]
+
+    for writer in [jsonl_report(tmp_path / "report.jsonl"),
+                   sqlite_report(tmp_path / "report.db", commit_every=2)]:
+        for entry in entries:
+            writer.write(entry)
+        writer.close()
+
+    with open(tmp_path / "report.jsonl") as lines:
+        assert [json.loads(line) for line in lines] == entries
+
+    db = sqlite3.connect(str(tmp_path / "report.db"))
+    assert db.execute(
+        "SELECT jira_id, heat, focal FROM report WHERE launchpad_id = 2"
+        ).fetchall() == [("KEY-2", 20, "New")]
+    assert db.execute(
+        "SELECT summary FROM report WHERE jira_id = 'KEY-3'"
+        ).fetchone() == (issue['Summary'],)
+    assert "USING INDEX" in db.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM report WHERE launchpad_id = 2"
+        ).fetchone()[-1]
+    db.close()
+
+    # Reports replace the previous one
+    writer = sqlite_report(tmp_path / "report.db")
+    writer.write(entries[0])
+    writer.close()
+    db = sqlite3.connect(str(tmp_path / "report.db"))
+    assert db.execute("SELECT count(*) FROM report").fetchone() == (1,)
+
+
+def test_reuse_previous_report(lp_rest, issue, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "LpToJira.lp_to_jira_report.thread_lp", lambda: lp_rest)
+    lp_rest.add_bug(1, "bug 1", [('systemd (Ubuntu)', 'New', 'High')])
+    lp_rest.add_bug(2, "bug 2", [('vim (Ubuntu)', 'Triaged', 'Low')])
+
+    previous = [
+        dict(issue, **{'LaunchPad ID': str(n),
+                       'Packages': "old-%d" % n,
+                       'LP Updated': "2022-01-0%dT00:00:00+00:00" % n})
+        for n in [1, 2, 3]]
+    previous[2]['Packages'] = "none"
+
+    generated = datetime.datetime.now(datetime.timezone.utc).replace(
+        microsecond=0) - datetime.timedelta(hours=1)
+    report = jsonl_report(tmp_path / "previous.jsonl", generated)
+    for entry in previous:
+        report.write(entry)
+    report.close()
+    loaded, since = load_previous_report(tmp_path / "previous.jsonl")
+    assert sorted(loaded) == ["1", "2", "3"]
+    assert since == generated
+
+    # Copying the file doesn't change when the report was generated
+    os.utime(tmp_path / "previous.jsonl")
+    assert load_previous_report(tmp_path / "previous.jsonl")[1] == generated
+
+    # Bug 2 changed since the previous report, bug 3 isn't in Ubuntu
+    ubuntu = Mock()
+    ubuntu.searchTasks.return_value = [
+        Mock(bug_link="https://api.launchpad.net/devel/bugs/2")]
+    lp_rest.distributions = {'ubuntu': ubuntu}
+
+    reuse = reusable_entries(lp_rest, loaded, since)
+    assert list(reuse) == ["1"]
+    assert ubuntu.searchTasks.call_args[1]['modified_since'] == \
+        generated.isoformat()
+
+    # Nor are the entries of a report that doesn't tell when it was made
+    assert reusable_entries(lp_rest, loaded, None) == {}
+
+    # Searching all the changes since an old report isn't worth it
+    ubuntu.searchTasks.reset_mock()
+    assert reusable_entries(
+        lp_rest, loaded, generated - datetime.timedelta(days=30)) == {}
+    ubuntu.searchTasks.assert_not_called()
+
+    reused, refreshed = row_stats.reused, row_stats.refreshed
+    entries = list(iter_lp_data(
+        Mock(), lp_rest,
+        [dict(issue, **{'LaunchPad ID': str(n)}) for n in [1, 2]],
+        reuse=reuse))
+
+    assert [entry['Packages'] for entry in entries] == ["old-1", "vim"]
+    assert entries[1]['LP Updated']
+    assert row_stats.reused - reused == 1
+    assert row_stats.refreshed - refreshed == 1
+
+
+def test_offline_report_from_store(lp_rest, issue, tmp_path):
+    lp_rest.add_bug(1, "bug 1", [('vim (Ubuntu Jammy)', 'Triaged', 'Low')])
+    issues = [dict(issue, **{'LaunchPad ID': str(n)}) for n in [1, 2]]
+
+    with lp_bug_store(tmp_path / "bugs") as store:
+        online = list(iter_lp_data(
+            Mock(), lp_rest, [dict(i) for i in issues], store=store))
+        assert store.ids() == [1]
+
+    # Launchpad isn't used at all, bug 2 wasn't stored
+    with lp_bug_store(tmp_path / "bugs") as store:
+        offline = list(iter_lp_data(
+            Mock(), Mock(side_effect=AssertionError), issues, store=store,
+            offline=True))
+
+    assert offline == online
+    assert offline[0]['Jammy'] == "Triaged"
+    assert offline[1]['Packages'] == ""
+
+
+def test_sync_uses_searched_issues(lp_rest):
+    jira_issue = Mock(key="KEY-1")
+    jira_issue.fields.summary = "LP#1 [vim] old title"
+    jira_issue.fields.status.name = "In Progress"
+    jira_issue.fields.labels = []
+
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=[[jira_issue], []])
+
+    lp_rest.add_bug(1, "new title", [('vim (Ubuntu)', 'Fix Released', 'Low')])
+    lp_rest.bugs = {1: Mock(title="new title")}
+
+    cache = jira_issue_cache(jira)
+    entries = list(iter_lp_data(
+        jira, lp_rest, iter_issues_in_project(jira, "FOO", cache=cache),
+        sync=True, cache=cache))
+
+    # The issue is released so it leaves the report, without any GET
+    assert entries == []
+    jira.issue.assert_not_called()
+    jira_issue.update.assert_called_once_with(
+        summary="LP#1 [vim] new title")
+    jira.transition_issue.assert_called_once_with(
+        jira_issue, transition='Done')
+    assert cache.get("KEY-1").fields.status.name == 'Done'
+
+
+def test_sync_uses_db_issues(lp_rest):
+    jira_issue = Mock(key="KEY-1")
+    jira_issue.fields.summary = "LP#1 [vim] old title"
+    jira_issue.fields.status.name = "In Progress"
+    jira_issue.fields.labels = ["foo"]
+
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=[[jira_issue], []])
+
+    lp_rest.add_bug(1, "new title", [('vim (Ubuntu)', 'Fix Released', 'Low')])
+    lp_rest.bugs = {1: Mock(title="new title")}
+
+    db = lp_jira_db(":memory:")
+    cache = jira_issue_cache(jira)
+    entries = list(iter_lp_data(
+        jira, lp_rest, iter_issues_in_project(jira, "FOO", db, cache),
+        sync=True, cache=cache))
+
+    # The issue is only fetched to update its summary
+    assert entries == []
+    jira.issue.assert_called_once_with("KEY-1")
+    jira.issue.return_value.update.assert_called_once_with(
+        summary="LP#1 [vim] new title")
+    assert str(jira.add_comment.call_args.args[0]) == "KEY-1"
+    assert str(jira.transition_issue.call_args.args[0]) == "KEY-1"
+
+
+def test_queued_sync_keeps_entry(lp_rest):
+    jira_issue = Mock(key="KEY-1")
+    jira_issue.fields.summary = "LP#1 [vim] title"
+    jira_issue.fields.status.name = "In Progress"
+    jira_issue.fields.labels = []
+
+    jira = Mock()
+    jira.search_issues = Mock(side_effect=[[jira_issue], []])
+    jira.transition_issue = Mock(side_effect=ValueError("conflict"))
+
+    lp_rest.add_bug(1, "title", [('vim (Ubuntu)', 'Fix Released', 'Low')])
+    lp_rest.bugs = {1: Mock(title="title")}
+
+    cache = jira_issue_cache(jira)
+    writes = jira_write_queue(jira, jobs=1, delay=0)
+    entries = list(iter_lp_data(
+        jira, lp_rest, iter_issues_in_project(jira, "FOO", cache=cache),
+        sync=True, cache=cache, writes=writes))
+    failed = writes.close()
+
+    # The transition failed after the entry was written, it had to stay
+    assert [entry['JIRA ID'] for entry in entries] == ["KEY-1"]
+    assert [str(action) for action, _ in failed] == \
+        ["transition of KEY-1 to Done"]
+    assert cache.get("KEY-1").fields.status.name == "In Progress"
+
+
+def test_report_row(issue):
+    entry = new_report_entry(
+        issue['JIRA ID'], issue['Summary'], issue['Status'],
+        issue['LaunchPad ID'])
+
+    assert isinstance(entry, report_row)
+    assert entry == issue
+    assert list(entry.keys()) == list(issue.keys())
+    assert json.loads(json.dumps(dict(entry))) == issue
+    assert not hasattr(entry, '__dict__')
+
+    entry['Focal'] = "Fix " + "Released"
+    assert entry.values()[list(entry).index('Focal')] == "Fix Released"
+    with pytest.raises(KeyError):
+        entry['Oneiric'] = "New"
+    with pytest.raises(TypeError):
+        del entry['Focal']
+
+    # Statuses of all the entries are the same strings
+    other = new_report_entry("KEY-2", "LP#2", "In " + "Progress", "2")
+    assert other['Status'] is entry['Status']
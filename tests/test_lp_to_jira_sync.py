@@ -0,0 +1,102 @@
+import datetime
+import random
+import pytest
+
+from unittest.mock import Mock
+
+from LpToJira.lp_to_jira_sync import monitor, poll_scheduler
+
+
+class fake_clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_poll_scheduler_intervals():
+    clock = fake_clock()
+    old = datetime.datetime.now(datetime.timezone.utc) - \
+        datetime.timedelta(days=30)
+    scheduler = poll_scheduler(
+        interval=60, max_interval=3600, jitter=0.1, clock=clock,
+        rand=random.Random(1))
+
+    scheduler.add("1", "%s" % datetime.datetime.now(datetime.timezone.utc))
+    scheduler.add("2", "%s" % old)
+    scheduler.add("3", "not a date")
+
+    # Quiet bugs start further apart
+    assert scheduler.intervals == {"1": 60, "2": 1800, "3": 60}
+
+    scheduler.polled("1", changed=False)
+    scheduler.polled("2", changed=False)
+    assert scheduler.intervals["1"] == 120
+    assert scheduler.intervals["2"] == 3600
+
+    # A change brings the bug back to the base interval, with jitter
+    scheduler.queue = []
+    scheduler.polled("2", changed=True)
+    assert scheduler.intervals["2"] == 60
+    [(due, bug)] = scheduler.queue
+    assert 54 <= due <= 66
+
+
+def test_poll_scheduler_budget():
+    clock = fake_clock()
+    scheduler = poll_scheduler(
+        interval=1, jitter=0, per_minute=2, clock=clock)
+    for bug in ["1", "2", "3"]:
+        scheduler.add(bug)
+
+    clock.now = 1
+    assert scheduler.next()[0] is not None
+    assert scheduler.next()[0] is not None
+
+    # The third one has to wait for the budget
+    bug, wait = scheduler.next()
+    assert bug is None
+    assert wait == 30
+
+    clock.now += wait
+    assert scheduler.next()[0] is not None
+    assert scheduler.next() == (None, 1)
+
+    # Neither a busy loop nor no request at all
+    for interval, per_minute in [(0, 60), (60, 0)]:
+        with pytest.raises(ValueError):
+            poll_scheduler(interval=interval, per_minute=per_minute)
+
+
+def test_monitor():
+    clock = fake_clock()
+    stop = Mock()
+    stop.is_set = Mock(side_effect=lambda: clock.now > 100)
+
+    def wait(seconds):
+        clock.now += seconds
+
+    stop.wait = Mock(side_effect=wait)
+
+    dates = {1: ["2022-01-01", "2022-01-02"], 2: ["2022-01-01"]}
+
+    def bug(id):
+        date = dates[id][0] if len(dates[id]) == 1 else dates[id].pop(0)
+        return Mock(date_last_updated=date)
+
+    lp = Mock()
+    lp.bugs.__getitem__ = Mock(side_effect=bug)
+    db = Mock()
+    jira_lp_db = {
+        "1": {'JIRA_KEY': "AA-1", 'LAST_CHANGE': "2022-01-01"},
+        "2": {'JIRA_KEY': "AA-2", 'LAST_CHANGE': "2022-01-01"}}
+
+    scheduler = poll_scheduler(interval=10, jitter=0, clock=clock)
+    monitor(lp, db, jira_lp_db, scheduler, stop)
+
+    # Each bug was polled a few times and not more than needed
+    db.set_lp_updated.assert_called_once_with("AA-1", "2022-01-02")
+    assert jira_lp_db["1"]['LAST_CHANGE'] == "2022-01-02"
+    assert 2 < lp.bugs.__getitem__.call_count < 20
+    assert scheduler.intervals["2"] > 10
@@ -0,0 +1,69 @@
+import threading
+
+from unittest.mock import Mock
+
+from LpToJira.lp_writeback import lp_bug_update, lp_writeback_queue
+
+
+def test_lp_bug_update(empty_bug):
+    update = lp_bug_update(empty_bug)
+    assert not update
+
+    update.save()
+    empty_bug.lp_save.assert_not_called()
+
+    update.append_description("\nlink")
+    update.add_tag("aa-1")
+    update.save()
+    update.save()
+
+    assert empty_bug.description == "\nlink"
+    assert empty_bug.tags == ["aa-1"]
+    assert empty_bug.lp_save.call_count == 2
+
+
+def test_lp_writeback_queue(empty_bug):
+    flaky_bug = Mock(id=1, description="", tags=[])
+    flaky_bug.lp_save = Mock(side_effect=[Exception("503"), None])
+
+    broken_bug = Mock(id=2, description="", tags=[])
+    broken_bug.lp_save = Mock(side_effect=Exception("403"))
+
+    writeback = lp_writeback_queue(retries=2, delay=0)
+    for bug in [flaky_bug, broken_bug, empty_bug]:
+        update = lp_bug_update(bug)
+        update.add_tag("aa-1")
+        writeback.put(update)
+    # Nothing to save for this one
+    writeback.put(lp_bug_update(Mock(id=3)))
+
+    failed = writeback.close()
+
+    assert list(failed.keys()) == [2]
+    assert str(failed[2]) == "403"
+    assert flaky_bug.lp_save.call_count == 2
+    assert flaky_bug.lp_refresh.call_count == 1
+    assert flaky_bug.tags == ["aa-1"]
+    assert broken_bug.lp_save.call_count == 3
+    assert empty_bug.lp_save.call_count == 1
+
+
+def test_lp_writeback_queue_connect():
+    threads = []
+    bug = Mock(id=1, description="", tags=[])
+
+    def load(link):
+        threads.append(threading.current_thread())
+        assert link == "https://api/bugs/1"
+        return bug
+
+    # The bug is loaded and saved through the session of the queue thread
+    writeback = lp_writeback_queue(lambda: Mock(load=load))
+    update = lp_bug_update(Mock(id=1, bug_link="https://api/bugs/1"))
+    update.add_tag("aa-1")
+    writeback.put(update)
+
+    assert writeback.close() == {}
+    assert threads == [writeback.thread]
+    assert bug.tags == ["aa-1"]
+    bug.lp_save.assert_called_once()
@@ -0,0 +1,60 @@
+import sys
+import threading
+import time
+
+from unittest.mock import Mock
+
+from LpToJira.workers import limit_requests, run_ordered
+
+
+def slow_square(value):
+    # Make the first items finish last
+    time.sleep(0.01 * (5 - value))
+    print("item {}".format(value))
+    if value == 3:
+        raise ValueError("bad item")
+    return value * value
+
+
+def test_run_ordered(capsys):
+    for jobs in [1, 4]:
+        results = list(run_ordered(slow_square, range(5), jobs))
+
+        assert [item for item, _, _ in results] == [0, 1, 2, 3, 4]
+        assert [result for _, result, _ in results] == [0, 1, 4, None, 16]
+        assert isinstance(results[3][2], ValueError)
+        assert capsys.readouterr().out == \
+            "item 0\nitem 1\nitem 2\nitem 3\nitem 4\n"
+
+
+def test_run_ordered_nested(capsys):
+    stdout = sys.stdout
+    pages = (result for _, result, _ in run_ordered(slow_square, range(3), 2))
+
+    results = [result for _, result, _ in run_ordered(
+        lambda value: value + 1, pages, 2)]
+
+    assert results == [1, 2, 5]
+    assert sys.stdout is stdout
+    assert capsys.readouterr().out == "item 0\nitem 1\nitem 2\n"
+
+
+def test_limit_requests():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def request(*args):
+        with lock:
+            running.append(args)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+
+    connection = Mock(request=request)
+    limit_requests(connection, 'test-host', 2)
+
+    list(run_ordered(connection.request, range(10), 8))
+
+    assert max(peak) == 2